@@ -0,0 +1,115 @@
+"""
+backfill.py
+"""
+import asyncio
+from typing import List, Dict, Callable, Awaitable, Optional, Any
+
+from astrbot.api import logger
+
+
+class GroupProgress:
+    """单个群的导入进度"""
+
+    def __init__(self, group_id: str, remaining: int):
+        self.group_id = group_id
+        self.remaining = remaining
+        self.seq = 0            # 0表示从最新消息开始
+        self.fetched = 0
+        self.imported = 0
+        self.error: Optional[str] = None
+
+
+class RoundRobinBackfill:
+    """
+    多群并发导入历史消息
+    每个群每次只处理一页，处理完再排到队尾，保证大群不会饿死小群；
+    OneBot调用和embedding调用分别限流
+    """
+
+    def __init__(self, group_ids: List[str], count: int, page_size: int,
+                 fetch_page: Callable[[str, int, int], Awaitable[list]],
+                 import_page: Callable[[str, Any], Awaitable[int]],
+                 prepare_page: Optional[Callable[[str, list], Awaitable[Any]]] = None,
+                 onebot_limit: int = 4, embed_limit: int = 2):
+        """
+        :param fetch_page: (群号, 起始消息序号, 条数) -> 按时间升序的消息列表
+        :param import_page: (群号, prepare_page的结果) -> 实际导入条数，在embedding限流内执行
+        :param prepare_page: (群号, 消息列表) -> 待导入的内容（去重、过滤等），不占用限流，默认原样传递消息列表
+        """
+        self.groups: Dict[str, GroupProgress] = {
+            str(group_id): GroupProgress(str(group_id), count) for group_id in group_ids
+        }
+        self.page_size = max(1, page_size)
+        self.fetch_page = fetch_page
+        self.import_page = import_page
+        self.prepare_page = prepare_page
+        self.onebot_semaphore = asyncio.Semaphore(max(1, onebot_limit))
+        self.embed_semaphore = asyncio.Semaphore(max(1, embed_limit))
+        self.workers = max(1, onebot_limit) + max(1, embed_limit)
+
+    async def _process_page(self, progress: GroupProgress) -> bool:
+        """处理一页，返回该群是否还有下一页"""
+        page_size = min(self.page_size, progress.remaining)
+        async with self.onebot_semaphore:
+            messages = await self.fetch_page(progress.group_id, progress.seq, page_size)
+        if not messages:
+            return False
+        progress.fetched += len(messages)
+        progress.remaining -= len(messages)
+
+        prepared = messages
+        if self.prepare_page is not None:
+            prepared = await self.prepare_page(progress.group_id, messages)
+        async with self.embed_semaphore:
+            progress.imported += await self.import_page(progress.group_id, prepared)
+
+        # 下一页从本页最早一条之前开始
+        seqs = [msg.get("message_seq") for msg in messages]
+        seqs = [int(seq) for seq in seqs if seq is not None]
+        if not seqs:
+            return False
+        next_seq = min(seqs) - 1
+        if next_seq <= 0 or (progress.seq and next_seq >= progress.seq):
+            return False
+        progress.seq = next_seq
+        return progress.remaining > 0 and len(messages) >= page_size
+
+    async def run(self) -> Dict[str, GroupProgress]:
+        queue: asyncio.Queue = asyncio.Queue()
+        for progress in self.groups.values():
+            queue.put_nowait(progress)
+
+        async def _worker():
+            while True:
+                progress = await queue.get()
+                try:
+                    if await self._process_page(progress):
+                        # 先重新入队再task_done，join不会在该群导完前返回
+                        queue.put_nowait(progress)
+                except Exception as e:
+                    progress.error = str(e)
+                    logger.error(f"[backfill]导入群{progress.group_id}失败: {str(e)}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(_worker()) for _ in range(self.workers)]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return self.groups
+
+    def report(self) -> str:
+        finished = [p for p in self.groups.values() if p.error is None]
+        failed = [p for p in self.groups.values() if p.error is not None]
+        lines = [
+            f"批量导入完成：{len(finished)}/{len(self.groups)}个群，"
+            f"读取{sum(p.fetched for p in self.groups.values())}条，"
+            f"导入{sum(p.imported for p in self.groups.values())}条"
+        ]
+        if failed:
+            lines.append("失败的群：")
+            lines.extend(f"{p.group_id}: {p.error}" for p in failed)
+        return "\n".join(lines)
@@ -0,0 +1,155 @@
+"""
+catalog.py
+"""
+import os
+import re
+import json
+import time
+import threading
+from typing import List, Dict, Optional, Tuple
+
+from astrbot.api import logger
+
+SAVE_INTERVAL = 30  # 增量更新后最多隔多少秒写一次盘
+
+
+def sanitize(name: str) -> str:
+    """与collection命名一致的字符替换"""
+    return re.sub(r'[^a-zA-Z0-9]', '_', name)
+
+
+def parse_collection_name(db_id: str) -> Tuple[str, str, str]:
+    """
+    从collection名中尽量还原 (模型, 平台, 群号)，只用于目录中没有登记的旧集合
+    命名规则为 模型_平台_GroupMessage_群号（均已做字符替换）
+    """
+    head, sep, group_id = db_id.rpartition("_GroupMessage_")
+    if not sep:
+        return db_id, "", db_id.split("_")[-1]
+    model, _, platform = head.rpartition("_")
+    return model, platform, group_id
+
+
+class Catalog:
+    """
+    本地持久化的集合目录：{db_id: {model, platform, group_id, count, size_bytes, updated_at}}
+    写入时增量更新条数，后台定期与数据库对账，/ca ls和按群查找只读本地内存
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._last_save = 0.0
+        self.entries: Dict[str, dict] = {}
+        self._index: Dict[Tuple[str, str, str], str] = {}
+        self._load()
+
+    @staticmethod
+    def _key(model: str, platform: str, group_id: str) -> Tuple[str, str, str]:
+        return sanitize(model), sanitize(platform), str(group_id)
+
+    def _load(self) -> None:
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError) as e:
+            # 目录损坏时从空目录开始，由后台对账重建
+            logger.error(f"读取集合目录失败，将重新对账: {str(e)}")
+            self.entries = {}
+        for db_id, entry in self.entries.items():
+            self._index[self._key(entry["model"], entry["platform"], entry["group_id"])] = db_id
+
+    def save(self, force: bool = False) -> None:
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._last_save < SAVE_INTERVAL):
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_save = time.time()
+
+    def _touch(self) -> None:
+        self._dirty = True
+        self.save()
+
+    def __contains__(self, db_id: str) -> bool:
+        return db_id in self.entries
+
+    def register(self, db_id: str, model: str, platform: str, group_id: str) -> None:
+        with self._lock:
+            entry = self.entries.get(db_id)
+            if entry is not None:
+                if (entry["model"], entry["platform"], entry["group_id"]) == (model, platform, str(group_id)):
+                    return
+                self._index.pop(self._key(entry["model"], entry["platform"], entry["group_id"]), None)
+            else:
+                entry = self.entries[db_id] = {"count": 0, "size_bytes": 0, "updated_at": int(time.time())}
+            entry.update({"model": model, "platform": platform, "group_id": str(group_id)})
+            self._index[self._key(model, platform, group_id)] = db_id
+            self._touch()
+
+    def add_count(self, db_id: str, delta: int, row_bytes: int = 0) -> None:
+        with self._lock:
+            entry = self.entries.get(db_id)
+            if entry is None:
+                return
+            entry["count"] = max(0, entry["count"] + delta)
+            entry["size_bytes"] = max(0, entry["size_bytes"] + delta * row_bytes)
+            entry["updated_at"] = int(time.time())
+            self._touch()
+
+    def set_stats(self, db_id: str, count: int, size_bytes: int) -> None:
+        with self._lock:
+            entry = self.entries.get(db_id)
+            if entry is None:
+                return
+            entry.update({"count": count, "size_bytes": size_bytes, "updated_at": int(time.time())})
+            self._touch()
+
+    def remove(self, db_id: str, older_than: Optional[float] = None) -> None:
+        """
+        :param older_than: 只在条目的更新时间早于该时间时删除，避免删掉对账期间新登记的集合
+        """
+        with self._lock:
+            entry = self.entries.get(db_id)
+            if entry is not None and older_than is not None and entry["updated_at"] >= older_than:
+                return
+            entry = self.entries.pop(db_id, None)
+            if entry is not None:
+                self._index.pop(self._key(entry["model"], entry["platform"], entry["group_id"]), None)
+                self._touch()
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self._index.clear()
+            self._dirty = True
+            self.save(force=True)
+
+    def get(self, db_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self.entries.get(db_id)
+            return dict(entry) if entry is not None else None
+
+    def lookup(self, model: str, platform: str, group_id: str) -> Optional[str]:
+        return self._index.get(self._key(model, platform, group_id))
+
+    def find(self, model: str, platform: str, group_ids: Optional[List[str]] = None) -> Dict[str, str]:
+        """返回某个模型和平台下的 {群号: db_id}"""
+        model, platform = sanitize(model), sanitize(platform)
+        with self._lock:
+            items = list(self._index.items())
+        return {
+            key[2]: db_id for key, db_id in items
+            if key[0] == model and key[1] == platform and (group_ids is None or key[2] in group_ids)
+        }
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {db_id: dict(entry) for db_id, entry in self.entries.items()}
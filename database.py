@@ -1,18 +1,49 @@
 """
 database.py
 """
-from pymilvus import connections, Collection, utility,  CollectionSchema
-from typing import List, Dict, Any,Optional
+import time
+import threading
+
+from pymilvus import connections, Collection, utility,  CollectionSchema, DataType
+from typing import List, Dict, Any,Optional, Iterator, Tuple, Callable, Set
 from astrbot.api import logger
 
+EXISTS_BATCH_SIZE = 1000    # 每次批量查询的message_id数量
+
+
+def count_rows(collection: Collection) -> int:
+    """
+    统计集合中实际的记录条数（集合需已load）
+    num_entities包含尚未compact的已删除记录，这里用count(*)查询
+    """
+    results = collection.query(expr="", output_fields=["count(*)"], consistency_level="Strong")
+    return int(results[0]["count(*)"]) if results else 0
+
 
 class Database:
     def __init__(self,config,fields):
         self.config=config
         self.fields=fields
+        # 记录条数变化时的回调（由DatabaseManager用于增量更新目录）
+        self.on_count_change: Optional[Callable[[int], None]] = None
+        # 同一集合同时只允许一个维护任务（后台任务与/ca maintain）
+        self.maintenance_lock = threading.Lock()
+
+    def _notify(self, delta: int) -> None:
+        if self.on_count_change is not None and delta:
+            self.on_count_change(delta)
+
+    @property
+    def row_bytes(self) -> int:
+        """单条记录大致占用的字节数"""
+        return 0
 
+    def size_bytes(self) -> int:
+        """集合大致占用的字节数"""
+        return self.count() * self.row_bytes
 
-    def add(self, message_id:int,embedding:List[float]) -> None:
+
+    def add(self, message_id:int,embedding:List[float], timestamp: Optional[int] = None) -> None:
         """
         添加新记录
         :param record: 要添加的记录字典
@@ -45,9 +76,104 @@ class Database:
         """
         pass
 
+    def similar_search_scored(self, embedding: List[float], limits: int) -> List[Tuple[int, float]]:
+        """
+        与similar_search相同，但同时返回相似度
+        :return: [(message_id, score)]，按score从高到低排列
+        """
+        pass
+
+    def similar_search_many(self, embeddings: List[List[float]], limits: int) -> List[List[Tuple[int, float]]]:
+        """
+        在一次请求中批量执行多个向量的相似搜索
+        :param embeddings: 查询的embedding列表
+        :return: 与embeddings一一对应的 [(message_id, score)] 列表
+        """
+        pass
+
     def exists(self, message_id: int) -> bool:
         pass
 
+    def exists_many(self, message_ids: List[int]) -> Set[int]:
+        """
+        批量判断记录是否存在
+        :return: 已存在的message_id集合
+        """
+        pass
+
+    def upsert_list(self, message_ids: List[int], embeddings: List[List[float]], flush: bool = True,
+                    timestamps: Optional[List[int]] = None) -> None:
+        """
+        批量写入记录，已存在的message_id会被覆盖
+        :param message_ids: 消息ID列表
+        :param embeddings: 对应的embedding列表
+        :param flush: 写入后是否立即落盘
+        :param timestamps: 消息发送时间（秒），为None时使用当前时间
+        """
+        pass
+
+    def iter_batches(self, batch_size: int = 4096) -> Iterator[Tuple[List[int], List[List[float]], Optional[List[int]]]]:
+        """
+        分批遍历集合中的全部记录
+        :param batch_size: 每批读取的条数
+        :return: (message_ids, embeddings, timestamps) 的迭代器，集合没有时间字段时timestamps为None
+        """
+        pass
+
+    def iter_timestamps(self, batch_size: int = 16384) -> Iterator[Tuple[List[int], List[int]]]:
+        """
+        分批遍历所有记录的message_id和时间，用于过期清理
+        :return: (message_ids, timestamps) 的迭代器
+        """
+        pass
+
+    @property
+    def supports_retention(self) -> bool:
+        """集合是否记录了消息时间（旧版本创建的集合没有）"""
+        return False
+
+    @property
+    def is_rebuilding(self) -> bool:
+        """是否正在重建索引（期间检索会被跳过）"""
+        return False
+
+    def delete(self, message_ids: List[int]) -> None:
+        """
+        按message_id删除记录
+        """
+        pass
+
+    def compact(self) -> None:
+        """
+        回收已删除记录占用的空间
+        """
+        pass
+
+    def rebuild_index(self) -> None:
+        """
+        重建向量索引
+        """
+        pass
+
+    def count(self) -> int:
+        """
+        :return: 集合中的记录条数
+        """
+        pass
+
+    def flush(self) -> None:
+        """
+        将未落盘的写入持久化
+        """
+        pass
+
+    def release(self) -> bool:
+        """
+        释放集合占用的内存，之后的读操作会按需重新加载
+        :return: 是否已释放（仍在使用时不释放）
+        """
+        return False
+
 
 
 
@@ -64,6 +190,14 @@ class Milvuscollection(Database):
         })
         self.connection_alias = config.get("connection_alias", "default")
 
+        # 重建索引期间集合处于释放状态，检索与查询需要与重建互斥
+        self._index_cond = threading.Condition()
+        self._readers = 0
+        self._rebuilding = False
+        self._released = False
+        # 写入与切换连接互斥，切换返回后不会再有写入落到原连接上
+        self._write_lock = threading.Lock()
+
         # 初始化集合（连接已由DatabaseManager建立）
         self.collection = self._init_collection()
 
@@ -87,22 +221,91 @@ class Milvuscollection(Database):
             collection = Collection(self.collection_name, using=self.connection_alias)
 
         collection.load()
+        # 旧版本创建的集合没有timestamp字段
+        self.has_timestamp = any(field.name == "timestamp" for field in collection.schema.fields)
+        self.dim = next(field.params["dim"] for field in collection.schema.fields if field.dtype == DataType.FLOAT_VECTOR)
         return collection
 
-    def add(self, message_id: int, embedding: List[float]) -> None:
-        # 构造插入数据
-        self.add_list([message_id], [embedding])
-    
-    def add_list(self, message_ids: List[int], embeddings: List[List[float]]) -> None:
-        # 构造插入数据
+    def _build_data(self, message_ids: List[int], embeddings: List[List[float]],
+                    timestamps: Optional[List[int]]) -> list:
         data = [
             message_ids,
             embeddings
         ]
+        if self.has_timestamp:
+            if timestamps is None:
+                timestamps = [int(time.time())] * len(message_ids)
+            data.append(timestamps)
+        return data
+
+    def _begin_read(self, wait: bool = True) -> bool:
+        """
+        开始一次需要集合已加载的读操作
+        :param wait: 正在重建索引时是否等待，为False时直接返回False
+        """
+        with self._index_cond:
+            if self._rebuilding:
+                if not wait:
+                    return False
+                self._index_cond.wait_for(lambda: not self._rebuilding)
+            if self._released:
+                # 被维护任务释放后仍有调用方持有该实例，按需重新加载
+                self.collection.load()
+                self._released = False
+            self._readers += 1
+            return True
+
+    def _end_read(self) -> None:
+        with self._index_cond:
+            self._readers -= 1
+            self._index_cond.notify_all()
+
+    def add(self, message_id: int, embedding: List[float], timestamp: Optional[int] = None) -> None:
+        # 构造插入数据
+        self.add_list([message_id], [embedding], timestamps=None if timestamp is None else [timestamp])
+    
+    def add_list(self, message_ids: List[int], embeddings: List[List[float]], flush: bool = True,
+                 timestamps: Optional[List[int]] = None) -> None:
+        # 构造插入数据
+        data = self._build_data(message_ids, embeddings, timestamps)
         # 执行插入操作
-        self.collection.insert(data)
+        with self._write_lock:
+            self.collection.insert(data)
+            if flush:
+                self.collection.flush()
+        self._notify(len(message_ids))
+
+    def upsert_list(self, message_ids: List[int], embeddings: List[List[float]], flush: bool = True,
+                    timestamps: Optional[List[int]] = None) -> None:
+        data = self._build_data(message_ids, embeddings, timestamps)
+        # 只有新增的message_id会改变条数，有目录回调时才额外查询
+        existing = self.exists_many(message_ids) if self.on_count_change is not None else set()
+        with self._write_lock:
+            self.collection.upsert(data)
+            if flush:
+                self.collection.flush()
+        self._notify(len(set(message_ids) - existing))
+
+    def flush(self) -> None:
         self.collection.flush()
 
+    def release(self) -> bool:
+        with self._index_cond:
+            if self._readers or self._rebuilding:
+                return False
+            self.collection.release()
+            self._released = True
+            return True
+
+    def redirect(self, connection_alias: str) -> None:
+        """
+        把后续读写切换到另一个连接上的同名集合（分片重平衡时使用）
+        会等待进行中的写入完成，目标集合需已存在
+        """
+        with self._write_lock:
+            self.connection_alias = connection_alias
+            self.collection = self._init_collection()
+
 
     def clear(self) -> None:
         # 删除整个集合
@@ -112,36 +315,160 @@ class Milvuscollection(Database):
 
 
     def similar_search(self, embedding: List[float],limits:int) -> Optional[list]:
+        return [message_id for message_id, _ in self.similar_search_scored(embedding, limits)]
+
+    def similar_search_scored(self, embedding: List[float], limits: int) -> List[Tuple[int, float]]:
+        return self.similar_search_many([embedding], limits)[0]
+
+    def similar_search_many(self, embeddings: List[List[float]], limits: int) -> List[List[Tuple[int, float]]]:
+        if not embeddings:
+            return []
         # 准备搜索参数
         search_params = {
             "metric_type": self.index_params["metric_type"],
             "params": {"nprobe": 10}
         }
 
-        # 执行向量搜索
-        results = self.collection.search(
-            data=[embedding],
-            anns_field="embedding",
-            param=search_params,
-            limit=limits,
-            output_fields=["message_id"]
-        )
-
-        # 处理搜索结果
-        if len(results) > 0:
-            return [
-                hit.entity.get("message_id")
-                for hit in results[0]
-            ]
-        return []
+        # 重建索引期间跳过检索，不阻塞调用方
+        if not self._begin_read(wait=False):
+            logger.warning(f"[similar_search]{self.collection_name}正在重建索引，跳过本次检索")
+            return [[] for _ in embeddings]
+        try:
+            # 多个查询向量合并为一次请求（nq=len(embeddings)）
+            results = self.collection.search(
+                data=embeddings,
+                anns_field="embedding",
+                param=search_params,
+                limit=limits,
+                output_fields=["message_id"]
+            )
+        finally:
+            self._end_read()
+
+        # 处理搜索结果，COSINE度量下distance越大越相似
+        return [
+            [(hit.entity.get("message_id"), hit.distance) for hit in hits]
+            for hits in results
+        ]
 
     def exists(self, message_id: int) -> bool:
-        results = self.collection.query(
-            expr=f"message_id in [{message_id}]",
-            output_fields=["message_id"],
-            limit=1
-        )
+        self._begin_read()
+        try:
+            results = self.collection.query(
+                expr=f"message_id in [{message_id}]",
+                output_fields=["message_id"],
+                limit=1
+            )
+        finally:
+            self._end_read()
         return len(results) > 0
 
+    def exists_many(self, message_ids: List[int]) -> Set[int]:
+        found = set()
+        self._begin_read()
+        try:
+            for start in range(0, len(message_ids), EXISTS_BATCH_SIZE):
+                batch = message_ids[start:start + EXISTS_BATCH_SIZE]
+                results = self.collection.query(
+                    expr=f"message_id in [{','.join(str(int(i)) for i in batch)}]",
+                    output_fields=["message_id"],
+                    limit=len(batch)
+                )
+                found.update(row["message_id"] for row in results)
+        finally:
+            self._end_read()
+        return found
+
+    def iter_batches(self, batch_size: int = 4096) -> Iterator[Tuple[List[int], List[List[float]], Optional[List[int]]]]:
+        # 使用query_iterator按主键顺序分页读取，避免一次性把整个集合读进内存
+        output_fields = ["message_id", "embedding"] + (["timestamp"] if self.has_timestamp else [])
+        self._begin_read()
+        try:
+            iterator = self.collection.query_iterator(
+                batch_size=batch_size,
+                output_fields=output_fields
+            )
+            try:
+                while True:
+                    rows = iterator.next()
+                    if not rows:
+                        break
+                    timestamps = [row["timestamp"] for row in rows] if self.has_timestamp else None
+                    yield [row["message_id"] for row in rows], [row["embedding"] for row in rows], timestamps
+            finally:
+                iterator.close()
+        finally:
+            self._end_read()
 
+    def iter_timestamps(self, batch_size: int = 16384) -> Iterator[Tuple[List[int], List[int]]]:
+        if not self.has_timestamp:
+            return
+        self._begin_read()
+        try:
+            iterator = self.collection.query_iterator(
+                batch_size=batch_size,
+                output_fields=["message_id", "timestamp"]
+            )
+            try:
+                while True:
+                    rows = iterator.next()
+                    if not rows:
+                        break
+                    yield [row["message_id"] for row in rows], [row["timestamp"] for row in rows]
+            finally:
+                iterator.close()
+        finally:
+            self._end_read()
+
+    @property
+    def supports_retention(self) -> bool:
+        return self.has_timestamp
+
+    @property
+    def is_rebuilding(self) -> bool:
+        return self._rebuilding
+
+    def delete(self, message_ids: List[int]) -> None:
+        if not message_ids:
+            return
+        with self._write_lock:
+            self.collection.delete(expr=f"message_id in [{','.join(str(int(i)) for i in message_ids)}]")
+        self._notify(-len(message_ids))
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * 4 + 8 + (8 if self.has_timestamp else 0)
+
+    def compact(self) -> None:
+        self.collection.flush()
+        self.collection.compact()
+        self.collection.wait_for_compaction_completed()
+
+    def rebuild_index(self) -> None:
+        # 大量删除后IVF聚类中心会失真，重新训练索引
+        # 等进行中的读操作结束后再释放集合，重建期间检索直接跳过，查询等待重建完成；写入不需要加载，照常进行
+        with self._index_cond:
+            self._rebuilding = True
+            self._index_cond.wait_for(lambda: self._readers == 0)
+        try:
+            self.collection.release()
+            self.collection.drop_index()
+            self.collection.create_index(
+                field_name="embedding",
+                index_params=self.index_params
+            )
+        finally:
+            try:
+                self.collection.load()
+            finally:
+                # load失败时也要恢复状态，否则等待重建的查询会一直阻塞
+                with self._index_cond:
+                    self._rebuilding = False
+                    self._index_cond.notify_all()
 
+    def count(self) -> int:
+        self._begin_read()
+        try:
+            return count_rows(self.collection)
+        finally:
+            self._end_read()
@@ -3,17 +3,26 @@ database_manager.py
 """
 import os
 import time
-from typing import Optional
+import shutil
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple, Callable, Any
 
 from pymilvus import utility, connections, MilvusClient, FieldSchema, DataType,Collection
 from pymilvus.exceptions import MilvusException
 from astrbot.api import logger
 
-from .database import Milvuscollection
+from .database import Database, Milvuscollection, count_rows
+from .numpy_database import NumpyCollection
+from .catalog import Catalog, parse_collection_name
+from .lexical import LexicalIndex, drop_index
+from .sharding import ConsistentHashRing, Shard, parse_server
+from .migration import CollectionMigrator
 
 
 class DatabaseManager:
-    """管理多个独立数据库实例的工厂类（支持lite模式）"""
+    """管理多个独立数据库实例的工厂类（支持lite模式、多服务器分片与本地numpy后端）"""
 
     def __init__(self, base_config,dim):
         self.base_config = base_config.copy()
@@ -28,22 +37,81 @@ class DatabaseManager:
                 name="embedding",
                 dtype=DataType.FLOAT_VECTOR,
                 dim=self.dim
+            ),
+            FieldSchema(
+                name="timestamp",
+                dtype=DataType.INT64
             )
         ]
-        self.databases = {}  # {db_id: MilvusDatabase}
+        self.databases = {}  # {db_id: Database}
+        # get_collection会在事件循环和后台线程中调用，同一集合的打开需要互斥，避免被打开两次；
+        # 不同集合各用一把锁，可以并发打开
+        self._open_lock = threading.RLock()
+        self._collection_locks: Dict[str, threading.Lock] = {}
+        self.maintenance_status: Dict[str, str] = {}  # {db_id: 后台维护进度}
+        self.lexical_indexes: Dict[str, LexicalIndex] = {}  # {db_id: 关键词索引}
+        self.backend = base_config.get("backend") or "milvus"
+        self.numpy_root = os.path.join(base_config.get("lite_path") or "data/astrbot_plugin_cyber_archaeology", "numpy")
+        self.lexical_root = os.path.join(base_config.get("lite_path") or "data/astrbot_plugin_cyber_archaeology", "lexical")
         self.client: Optional[MilvusClient] = None  # lite模式专用client
         self.__initialized = True
         self.isconnected=False
         self.connection_alias = "ca_lite" if base_config.get("islite", True) else "ca_server"
 
+        # 配置了servers时按一致性哈希把集合分布到多台服务器，否则只有一个沿用原连接的分片
+        servers = [str(entry).strip() for entry in (base_config.get("servers") or []) if str(entry).strip()]
+        self.sharded = self.backend != "numpy" and bool(servers)
+        self.shards: Dict[str, Shard] = {}
+        self._locations: Dict[str, str] = {}  # {db_id: 集合实际所在的分片名}
+        if self.sharded:
+            pool_size = max(1, int(base_config.get("pool_size") or 2))
+            for i, entry in enumerate(servers):
+                params = parse_server(entry, base_config.get("user", ""), base_config.get("password", ""))
+                self.shards[entry] = Shard(entry, params, [f"ca_shard{i}_{j}" for j in range(pool_size)])
+        else:
+            self.shards["default"] = Shard("default", None, [self.connection_alias])
+        self.ring = ConsistentHashRing(list(self.shards))
+
+        if self.backend == "numpy":
+            catalog_name = "numpy"
+        else:
+            catalog_name = "sharded" if self.sharded else self.connection_alias
+        self.catalog = Catalog(os.path.join(
+            base_config.get("lite_path") or "data/astrbot_plugin_cyber_archaeology",
+            f"catalog_{catalog_name}.json"
+        ))
+
         self.connect()
 
+    def _lite_db_path(self) -> str:
+        lite_path = self.base_config["lite_path"]
+        os.makedirs(lite_path, exist_ok=True)
+        return os.path.join(lite_path,"milvus_lite.db")
+
+    def _server_params(self) -> dict:
+        return {
+            "host": self.base_config.get("host") or "localhost",
+            "port": self.base_config.get("port") or "19530",
+            "user": self.base_config.get("user", ""),
+            "password": self.base_config.get("password", ""),
+        }
+
+    def connect_alias(self, alias: str, islite: bool) -> None:
+        """按配置为另一种模式额外建立一个连接（用于迁移），不影响当前连接"""
+        try:
+            if islite:
+                connections.connect(alias=alias, uri=self._lite_db_path())
+            else:
+                connections.connect(alias=alias, **self._server_params())
+            logger.info(f"已建立{'lite' if islite else '服务器'}模式连接 {alias}")
+        except MilvusException as e:
+            logger.error(f"建立连接{alias}失败：{str(e)}")
+            raise
+
     def _connect_lite(self) -> None:
         """嵌入式模式连接（带异常分类）"""
-        lite_path = self.base_config["lite_path"]
         try:
-            os.makedirs(lite_path, exist_ok=True)
-            lite_db_path=os.path.join(lite_path,"milvus_lite.db")
+            lite_db_path=self._lite_db_path()
             # 初始化客户端
             self.client = MilvusClient(lite_db_path)
             connections.connect(alias=self.connection_alias, uri=lite_db_path)
@@ -54,20 +122,10 @@ class DatabaseManager:
 
     def _connect_server(self) -> None:
         """服务器模式连接（带异常处理）"""
-        host = self.base_config.get("host", "localhost")
-        port = self.base_config.get("port", "19530")
-        user = self.base_config.get("user", "")
-        password = self.base_config.get("password", "")
-
+        params = self._server_params()
         try:
-            connections.connect(
-                alias=self.connection_alias,
-                host=host,
-                port=port,
-                user=user,
-                password=password
-            )
-            logger.info(f"服务器模式连接成功：{host}:{port}")
+            connections.connect(alias=self.connection_alias, **params)
+            logger.info(f"服务器模式连接成功：{params['host']}:{params['port']}")
         except MilvusException as e:
             # 如果是认证相关问题，可以手动检查错误信息
             if "authentication" in str(e).lower():
@@ -76,12 +134,31 @@ class DatabaseManager:
                 logger.error(f"服务器连接失败：{e}")
             raise
 
+    def _connect_shards(self) -> None:
+        """分片模式：为每台服务器建立一组连接"""
+        for shard in self.shards.values():
+            try:
+                for alias in shard.aliases:
+                    connections.connect(alias=alias, **shard.params)
+                logger.info(f"分片{shard.name}连接成功，连接池大小{len(shard.aliases)}")
+            except MilvusException as e:
+                logger.error(f"分片{shard.name}连接失败：{e}")
+                raise
+
     def connect(self, retries: int = 2) -> None:
         """显式建立连接（带重试机制）"""
         self.disconnect()  # 先断开旧连接
+        if self.backend == "numpy":
+            # 本地文件后端无需建立连接
+            os.makedirs(self.numpy_root, exist_ok=True)
+            self.isconnected=True
+            logger.info(f"numpy后端已启用，路径：{self.numpy_root}")
+            return
         for attempt in range(retries + 1):
             try:
-                if self.base_config.get("islite", True):
+                if self.sharded:
+                    self._connect_shards()
+                elif self.base_config.get("islite", True):
                     self._connect_lite()
                 else:
                     self._connect_server()
@@ -95,6 +172,23 @@ class DatabaseManager:
 
     def disconnect(self) -> None:
         """安全关闭所有连接"""
+        self.catalog.save(force=True)
+        for index in self.lexical_indexes.values():
+            index.close()
+        self.lexical_indexes.clear()
+        if self.isconnected and self.backend == "numpy":
+            self.databases.clear()
+            self.isconnected=False
+            return
+        if self.isconnected and self.sharded:
+            for shard in self.shards.values():
+                for alias in shard.aliases:
+                    connections.disconnect(alias)
+            self.databases.clear()
+            self._locations.clear()
+            logger.info("成功断开所有分片连接")
+            self.isconnected=False
+            return
         if self.isconnected:
             alias = "ca_lite" if self.base_config.get("islite", True) else "ca_server"
             try:
@@ -108,63 +202,283 @@ class DatabaseManager:
                 logger.error(f"断开连接时发生错误：{str(e)}")
                 raise
 
-    def get_collection(self, db_id: str) -> 'Milvuscollection':
-        """获取指定ID的数据库实例，如果没有就创建一个"""
+    def _fan_out(self, fn: Callable[[Shard], Any]) -> List[Any]:
+        """在所有分片上并行执行fn"""
+        shards = list(self.shards.values())
+        if len(shards) == 1:
+            return [fn(shards[0])]
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            return list(pool.map(fn, shards))
+
+    def _shard_of(self, db_id: str) -> Shard:
+        """集合所在的分片：优先用已知位置，其次哈希环归属，都没有时在其他分片上查找"""
+        if not self.sharded:
+            return self.shards["default"]
+        if db_id in self._locations:
+            return self.shards[self._locations[db_id]]
+        owner = self.shards[self.ring.get_node(db_id)]
+        location = owner
+        if not utility.has_collection(db_id, using=owner.alias):
+            for shard in self.shards.values():
+                if shard is not owner and utility.has_collection(db_id, using=shard.alias):
+                    location = shard
+                    break
+        self._locations[db_id] = location.name
+        return location
+
+    def _list_by_shard(self) -> Dict[str, List[str]]:
+        """并行列出每个分片上的集合，并刷新集合位置"""
+        listed = dict(zip(self.shards, self._fan_out(lambda shard: utility.list_collections(using=shard.alias))))
+        found: Dict[str, List[str]] = {}
+        for shard_name, names in listed.items():
+            for name in names:
+                found.setdefault(name, []).append(shard_name)
+        by_shard: Dict[str, List[str]] = {name: [] for name in self.shards}
+        for name, shard_names in found.items():
+            # 同一集合出现在多个分片上（迁移中）时，保持原位置
+            location = self._locations.get(name)
+            if location not in shard_names:
+                owner = self.ring.get_node(name)
+                location = owner if owner in shard_names else shard_names[0]
+            self._locations[name] = location
+            by_shard[location].append(name)
+        return by_shard
+
+    def _open_collection(self, db_id: str) -> Database:
+        config = self.base_config.copy()
+        config.update({
+            "collection_name": db_id,
+            "connection_alias": self._shard_of(db_id).next_alias(),  # 传递连接别名（分片模式下轮流使用连接池）
+            "numpy_root": self.numpy_root,
+            "dim": self.dim
+        })
+        if self.backend == "numpy":
+            return NumpyCollection(config, self.fields)
+        return Milvuscollection(config, self.fields)
+
+    def _drop_collection(self, db_id: str) -> None:
+        if self.backend == "numpy":
+            shutil.rmtree(os.path.join(self.numpy_root, db_id), ignore_errors=True)
+        else:
+            utility.drop_collection(db_id,using=self._shard_of(db_id).alias)
+            self._locations.pop(db_id, None)
+        self.databases.pop(db_id, None)
+
+    def _stats(self, db_id: str) -> Tuple[int, int]:
+        """读取集合的 (条数, 大致占用字节数)"""
+        collection = self.databases.get(db_id)
+        if collection is not None:
+            return collection.count(), collection.size_bytes()
+        if self.backend == "numpy":
+            # 未打开的集合直接读文件，不创建实例
+            return NumpyCollection.read_stats(self.numpy_root, db_id)
+        # 未打开过的Milvus集合不load，只读取统计信息
+        collection = Collection(db_id, using=self._shard_of(db_id).alias)
+        try:
+            count = count_rows(collection)
+        except MilvusException:
+            # 集合未load时无法count(*)；num_entities包含未compact的已删除记录，目录中已有条数时沿用
+            entry = self.catalog.get(db_id)
+            count = entry["count"] if entry is not None else collection.num_entities
+        row_bytes = 8
+        for field in collection.schema.fields:
+            if field.dtype == DataType.FLOAT_VECTOR:
+                row_bytes += field.params["dim"] * 4
+            elif field.name != "message_id":
+                row_bytes += 8
+        return count, count * row_bytes
+
+    def _collection_lock(self, db_id: str) -> threading.Lock:
+        with self._open_lock:
+            return self._collection_locks.setdefault(db_id, threading.Lock())
+
+    def get_collection(self, db_id: str, origin: Optional[Tuple[str, str, str]] = None) -> Database:
+        """
+        获取指定ID的数据库实例，如果没有就创建一个
+        :param origin: (模型, 平台, 群号)，用于登记到集合目录
+        """
+        collection = self.databases.get(db_id)
+        if collection is None:
+            with self._open_lock:
+                if not self.isconnected:
+                    self.connect()
+            with self._collection_lock(db_id):
+                collection = self.databases.get(db_id)
+                if collection is None:
+                    collection = self._open_collection(db_id)
+                    collection.on_count_change = lambda delta, db_id=db_id, collection=collection: self.catalog.add_count(db_id, delta, collection.row_bytes)
+                    self.databases[db_id] = collection
+                    if db_id not in self.catalog:
+                        self.catalog.register(db_id, *(origin or parse_collection_name(db_id)))
+                        self.catalog.set_stats(db_id, collection.count(), collection.size_bytes())
+        if origin is not None:
+            self.catalog.register(db_id, *origin)
+        return collection
+    
+    def release_collection(self, db_id: str) -> None:
+        """释放集合占用的内存（Milvus即release），下次get_collection时重新打开"""
+        # 与get_collection互斥，避免刚打开的实例被释放
+        with self._collection_lock(db_id):
+            collection = self.databases.get(db_id)
+            # numpy实例持有文件的写入状态，调用方可能仍在使用，同一目录不能再打开第二个实例，只释放内存映射
+            if collection is not None and collection.release() and self.backend != "numpy":
+                self.databases.pop(db_id, None)
+
+    def get_lexical(self, db_id: str) -> LexicalIndex:
+        """获取集合对应的关键词索引"""
+        index = self.lexical_indexes.get(db_id)
+        if index is None:
+            with self._open_lock:
+                index = self.lexical_indexes.get(db_id)
+                if index is None:
+                    index = self.lexical_indexes[db_id] = LexicalIndex(os.path.join(self.lexical_root, db_id + ".sqlite3"))
+        return index
+
+    def _drop_lexical(self, db_id: str) -> None:
+        index = self.lexical_indexes.pop(db_id, None)
+        if index is not None:
+            index.close()
+        drop_index(os.path.join(self.lexical_root, db_id + ".sqlite3"))
+
+    def fetch_collection(self, model: str, platform: str, group_id: str) -> Optional[Database]:
+        """根据模型、平台和群号从目录中找到对应的collection"""
+        db_id = self.catalog.lookup(model, platform, group_id)
+        if db_id is None:
+            return None
+        return self.get_collection(db_id)
+
+    def has_collection(self, db_id: str) -> bool:
+        """
+        向后端确认集合是否存在（目录可能因未及时保存等原因缺少条目，删除前不能只看目录）
+        """
+        if db_id in self.databases:
+            return True
         if not self.isconnected:
             self.connect()
-        if db_id not in self.databases:
-            config = self.base_config.copy()
-            config.update({
-                "collection_name": db_id,
-                "connection_alias": self.connection_alias  # 传递连接别名
-            })
-            self.databases[db_id] = Milvuscollection(config, self.fields)
-        return self.databases[db_id]
+        if self.backend == "numpy":
+            return os.path.isfile(os.path.join(self.numpy_root, db_id, "meta.json"))
+        return utility.has_collection(db_id, using=self._shard_of(db_id).alias)
     
-    def fetch_collection(self, group_id: str) -> 'Milvuscollection':
-        """根据群号找到对应的collection"""
+    def list_collection_names(self) -> List[str]:
+        """返回当前连接下所有collection的名字"""
         if not self.isconnected:
             self.connect()
-        try:
-            collections = utility.list_collections(using=self.connection_alias)
-            for collection_name in collections:
-                if group_id in collection_name:
-                    config = self.base_config.copy()
-                    config.update({
-                        "collection_name": collection_name,
-                        "connection_alias": self.connection_alias  # 传递连接别名
-                    })
-                    return Milvuscollection(config, self.fields)
-        except Exception as e:
-            logger.error(f"获取集合时发生错误: {str(e)}")
-            raise
+        if self.backend == "numpy":
+            return NumpyCollection.list_names(self.numpy_root)
+        return [name for names in self._list_by_shard().values() for name in names]
+
+    def find_group_collections(self, model: str, platform: str, group_ids: Optional[List[str]] = None) -> Dict[str, str]:
+        """
+        从目录中找出某个模型和平台下的群聊collection
+        :param group_ids: 只返回这些群，为None时返回全部
+        :return: {群号: collection名}
+        """
+        return self.catalog.find(model, platform, group_ids)
+
+    def reconcile_catalog(self) -> None:
+        """与数据库对账：补登记未知集合、移除已不存在的集合并刷新条数"""
+        started = time.time()
+        names = self.list_collection_names()
+        # 列出集合之后才登记的条目不在names中，只删除列出前就存在的条目
+        for db_id in set(self.catalog.snapshot()) - set(names):
+            self.catalog.remove(db_id, older_than=int(started))
+        for db_id in names:
+            if db_id not in self.catalog:
+                self.catalog.register(db_id, *parse_collection_name(db_id))
+
+        def _refresh(shard: Shard) -> None:
+            for db_id in names:
+                if self._shard_of(db_id) is not shard:
+                    continue
+                try:
+                    self.catalog.set_stats(db_id, *self._stats(db_id))
+                except Exception as e:
+                    logger.error(f"读取集合{db_id}统计信息失败: {str(e)}")
+
+        # 各分片并行读取统计信息
+        self._fan_out(_refresh)
+        self.catalog.save(force=True)
+
+    async def rebalance(self, progress_dir: str, parallel: int = 4) -> Dict[str, object]:
+        """
+        把不在哈希环归属分片上的集合迁移过去（新增服务器后执行）
+        先把读写切到新分片，再把旧数据用upsert补齐，最后删除原分片上的集合，
+        复制期间的新消息直接写入新分片，不会丢失
+        :return: {集合名: 复制条数或异常}
+        """
+        if not self.sharded:
+            return {}
+        # 按各分片实际列出的集合计算，上次中断后两边都有的集合也会继续迁移
+        listed = await asyncio.to_thread(self._fan_out, lambda shard: utility.list_collections(using=shard.alias))
+        moves: Dict[Tuple[str, str], List[str]] = {}
+        for src, names in zip(self.shards, listed):
+            for db_id in names:
+                dst = self.ring.get_node(db_id)
+                if src != dst:
+                    moves.setdefault((src, dst), []).append(db_id)
+
+        semaphore = asyncio.Semaphore(max(1, parallel))
+
+        async def _move_one(migrator: CollectionMigrator, src: str, dst: str, db_id: str) -> int:
+            async with semaphore:
+                await asyncio.to_thread(migrator.prepare, db_id)
+                # 切换后新的读写都落到新分片；已打开的集合等进行中的写入完成后再切换
+                self._locations[db_id] = dst
+                collection = self.databases.get(db_id)
+                if collection is not None:
+                    await asyncio.to_thread(collection.redirect, self.shards[dst].next_alias())
+                else:
+                    collection = self.get_collection(db_id)
+                # 复制期间暂停该集合的过期清理，避免已删除的记录被旧数据补回
+                await asyncio.to_thread(collection.maintenance_lock.acquire)
+                try:
+                    copied = await asyncio.to_thread(migrator.migrate_collection, db_id)
+                finally:
+                    collection.maintenance_lock.release()
+                await asyncio.to_thread(utility.drop_collection, db_id, using=self.shards[src].alias)
+                logger.info(f"[rebalance]{db_id}已从{src}迁移到{dst}")
+                return copied
+
+        async def _move(src: str, dst: str, names: List[str]) -> Dict[str, object]:
+            src_index, dst_index = list(self.shards).index(src), list(self.shards).index(dst)
+            migrator = CollectionMigrator(
+                self.shards[src].alias, self.shards[dst].alias,
+                os.path.join(progress_dir, f"rebalance_{src_index}_{dst_index}.json"),
+                parallel=parallel, upsert=True
+            )
+            results = await asyncio.gather(*[_move_one(migrator, src, dst, db_id) for db_id in names], return_exceptions=True)
+            for db_id, result in zip(names, results):
+                if isinstance(result, Exception):
+                    logger.error(f"[rebalance]{db_id}迁移失败: {str(result)}")
+            if not any(isinstance(result, Exception) for result in results):
+                migrator.clear_progress()
+            return dict(zip(names, results))
+
+        merged: Dict[str, object] = {}
+        for results in await asyncio.gather(*[_move(src, dst, names) for (src, dst), names in moves.items()]):
+            merged.update(results)
+        return merged
 
-        return None
-    
     def __str__(self) -> str:
-        """返回当前数据库实例的字符串表示"""
+        """返回当前数据库实例的字符串表示（只读取本地目录）"""
         lines= []
         group_model={}
-        try:
-            # lines.append(f"DatabaseManager(isconnected={self.isconnected}.self.alias={self.connection_alias}):")
-            collections = utility.list_collections(using=self.connection_alias)
-            for collection_name in collections:
-                collection = Collection(collection_name, using=self.connection_alias)
-                parts=collection_name.split("_")
-                group_id = parts[-1]
-                model_info="\t"+"_".join(parts[0:-4])+"\t"+str(collection.num_entities)
-                if group_id not in group_model:
-                    group_model[group_id]=[model_info]
-                else:
-                    group_model[group_id].append(model_info)
-            for group_id, model_ids in group_model.items():
-                model_id = "\n\r".join(model_ids)
-                lines.append(f"群 {group_id}:")
-                lines.append(model_id)
-            return "\r\n".join(lines)
-        except Exception as e:
-            logger.error(f"获取连接信息出现错误: {str(e)}")
-            raise
+        for collection_name, entry in sorted(self.catalog.snapshot().items()):
+            group_id = entry["group_id"]
+            model_info="\t"+entry["model"]+"\t"+str(entry["count"])+f"\t{entry['size_bytes'] / 1024 / 1024:.1f}MB"
+            if self.sharded and collection_name in self._locations:
+                model_info+="\t@"+self._locations[collection_name]
+            if collection_name in self.maintenance_status:
+                model_info+="\t[维护: "+self.maintenance_status[collection_name]+"]"
+            if group_id not in group_model:
+                group_model[group_id]=[model_info]
+            else:
+                group_model[group_id].append(model_info)
+        for group_id, model_ids in group_model.items():
+            model_id = "\n\r".join(model_ids)
+            lines.append(f"群 {group_id}:")
+            lines.append(model_id)
+        return "\r\n".join(lines)
         
 
 
@@ -173,8 +487,10 @@ class DatabaseManager:
         if not self.isconnected:
             self.connect()
         try:
-            utility.drop_collection(db_id,using=self.connection_alias)
-            del self.databases[db_id]
+            self._drop_collection(db_id)
+            self._drop_lexical(db_id)
+            self.catalog.remove(db_id)
+            self.maintenance_status.pop(db_id, None)
             logger.info(f"已删除集合: {db_id}")
         except Exception as e:
             logger.error(f"删除集合时发生错误: {str(e)}")
@@ -184,19 +500,29 @@ class DatabaseManager:
         """
         清空所有数据库实例
         执行步骤：
-        1. 删除所有Milvus集合
+        1. 删除所有集合
         2. 清除实例缓存
         """
         if not self.isconnected:
             self.connect()
 
         try:
-            collections = utility.list_collections(using=self.connection_alias)
+            if self.backend == "numpy":
+                collections = self.list_collection_names()
+                for collection_name in collections:
+                    self._drop_collection(collection_name)
+            else:
+                # 各分片并行删除
+                by_shard = self._list_by_shard()
+                self._fan_out(lambda shard: [utility.drop_collection(name, using=shard.alias) for name in by_shard[shard.name]])
+                collections = [name for names in by_shard.values() for name in names]
             for collection_name in collections:
-                if collection_name in self.databases:
-                    del self.databases[collection_name]
-                utility.drop_collection(collection_name,using=self.connection_alias)
+                self.databases.pop(collection_name, None)
+                self._locations.pop(collection_name, None)
+                self._drop_lexical(collection_name)
+                self.maintenance_status.pop(collection_name, None)
                 logger.info(f"已删除集合: {collection_name}")
+            self.catalog.clear()
         except Exception as e:
             logger.error(f"删除所有集合时发生错误: {str(e)}")
             raise
\ No newline at end of file
@@ -0,0 +1,28 @@
+"""
+fusion.py
+"""
+import heapq
+from typing import Iterable, List, Tuple, Any, Dict
+
+
+def merge_topk(result_lists: Iterable[Iterable[Tuple[Any, float]]], k: int) -> List[Tuple[Any, float]]:
+    """
+    合并多路 (key, score) 结果，按score取全局前k个
+    :param result_lists: 每一路的搜索结果
+    :param k: 返回数量
+    """
+    return heapq.nlargest(k, (item for results in result_lists for item in results), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(result_lists: Iterable[Iterable[Tuple[Any, float]]], k: int, rrf_k: int = 60) -> List[Tuple[Any, float]]:
+    """
+    用RRF融合多路排序结果，只使用名次，不要求各路score可比
+    :param result_lists: 每一路按相关度从高到低排列的 (key, score)
+    :param k: 返回数量
+    :param rrf_k: RRF平滑常数
+    """
+    fused: Dict[Any, float] = {}
+    for results in result_lists:
+        for rank, (key, _) in enumerate(results):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return heapq.nlargest(k, fused.items(), key=lambda item: item[1])
@@ -0,0 +1,200 @@
+"""
+lexical.py
+"""
+import os
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from typing import List, Tuple
+
+from astrbot.api import logger
+
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+# 英文、数字以及由符号连接的整体（网址、型号、邮箱等）
+ASCII_TOKEN = re.compile(r"[A-Za-z0-9]+(?:[._\-/:@#?=&%+]+[A-Za-z0-9]+)*")
+ASCII_PART = re.compile(r"[A-Za-z0-9]+")
+CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+KEYWORD_QUERY = re.compile(r"^[A-Za-z0-9._\-/:@#?=&%+]+$")
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 出现在超过该比例消息中的词几乎不影响排序，跳过以免读取过长的倒排表
+MAX_TOKEN_DF_RATIO = 0.1
+MIN_TOKEN_DF_CAP = 1000
+
+
+def _cjk_tokens(run: str) -> List[str]:
+    if jieba is not None:
+        return [word for word in jieba.lcut_for_search(run) if word.strip()]
+    # 没有安装jieba时使用二元切分
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def tokenize(text: str) -> List[str]:
+    """把消息切成词项：英文数字整体及其各部分小写，中文用jieba或二元切分"""
+    tokens = []
+    for match in ASCII_TOKEN.finditer(text):
+        token = match.group().lower()
+        tokens.append(token)
+        parts = ASCII_PART.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    for match in CJK_RUN.finditer(text):
+        tokens.extend(_cjk_tokens(match.group()))
+    return tokens
+
+
+def is_keyword_query(query: str) -> bool:
+    """
+    判断是否为适合直接走关键词索引的查询：网址、型号、代码等英文数字组成的词，
+    或jieba切分后只有一个词的中文（人名、专有名词）；普通短句仍走语义检索
+    """
+    query = query.strip()
+    if not query or any(ch.isspace() for ch in query):
+        return False
+    if KEYWORD_QUERY.match(query):
+        return True
+    # 没有安装jieba时无法判断中文是否为单个词
+    if jieba is None or not CJK_RUN.fullmatch(query):
+        return False
+    return len(jieba.lcut(query)) == 1
+
+
+class LexicalIndex:
+    """基于sqlite的倒排索引，保存消息原文并用BM25打分"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                message_id INTEGER PRIMARY KEY,
+                length INTEGER NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                token TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (token, message_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_message ON postings(message_id);
+        """)
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def add_many(self, message_ids: List[int], texts: List[str]) -> None:
+        docs, postings = [], []
+        for message_id, text in zip(message_ids, texts):
+            counts = Counter(tokenize(text))
+            if not counts:
+                continue
+            docs.append((int(message_id), sum(counts.values()), text))
+            postings.extend((token, int(message_id), tf) for token, tf in counts.items())
+        if not docs:
+            return
+        with self._lock, self._conn:
+            # 同一条消息重复写入时先删掉旧的词项
+            self._conn.executemany("DELETE FROM postings WHERE message_id = ?", [(doc[0],) for doc in docs])
+            self._conn.executemany("INSERT OR REPLACE INTO docs VALUES (?, ?, ?)", docs)
+            self._conn.executemany("INSERT OR REPLACE INTO postings VALUES (?, ?, ?)", postings)
+
+    def add(self, message_id: int, text: str) -> None:
+        self.add_many([message_id], [text])
+
+    def delete(self, message_ids: List[int]) -> None:
+        rows = [(int(message_id),) for message_id in message_ids]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM postings WHERE message_id = ?", rows)
+            self._conn.executemany("DELETE FROM docs WHERE message_id = ?", rows)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def backup_to(self, path: str) -> None:
+        """把索引完整复制到path（sqlite在线备份，写入过程中也保持一致）"""
+        target = sqlite3.connect(path)
+        try:
+            with self._lock:
+                self._conn.backup(target)
+        finally:
+            target.close()
+
+    def merge_from(self, path: str) -> int:
+        """
+        把备份中的消息合并进当前索引，同一条消息以备份为准
+        :return: 备份中的消息条数
+        """
+        with self._lock:
+            self._conn.execute("ATTACH DATABASE ? AS src", (path,))
+            try:
+                with self._conn:
+                    self._conn.execute("DELETE FROM postings WHERE message_id IN (SELECT message_id FROM src.docs)")
+                    self._conn.execute("INSERT OR REPLACE INTO docs SELECT message_id, length, text FROM src.docs")
+                    self._conn.execute("INSERT OR REPLACE INTO postings SELECT token, message_id, tf FROM src.postings")
+                return self._conn.execute("SELECT COUNT(*) FROM src.docs").fetchone()[0]
+            finally:
+                self._conn.execute("DETACH DATABASE src")
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """
+        BM25检索
+        :return: [(message_id, score)]，按score从高到低排列
+        """
+        tokens = set(tokenize(query))
+        if not tokens or limit <= 0:
+            return []
+        with self._lock:
+            total, avg_length = self._conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+            if not total:
+                return []
+            doc_freqs = {
+                token: self._conn.execute("SELECT COUNT(*) FROM postings WHERE token = ?", (token,)).fetchone()[0]
+                for token in tokens
+            }
+            doc_freqs = {token: df for token, df in doc_freqs.items() if df}
+            if not doc_freqs:
+                return []
+            cap = max(MIN_TOKEN_DF_CAP, int(total * MAX_TOKEN_DF_RATIO))
+            selected = [token for token, df in doc_freqs.items() if df <= cap]
+            if not selected:
+                # 全是高频词时只用最少见的一个
+                selected = [min(doc_freqs, key=doc_freqs.get)]
+            scores = Counter()
+            for token in selected:
+                rows = self._conn.execute(
+                    "SELECT p.message_id, p.tf, d.length FROM postings p JOIN docs d USING (message_id) WHERE p.token = ?",
+                    (token,)
+                ).fetchall()
+                idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+                for message_id, tf, length in rows:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[message_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores.most_common(limit)
+
+
+def drop_index(path: str) -> None:
+    """删除索引文件（含WAL）"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.isfile(path + suffix):
+            try:
+                os.remove(path + suffix)
+            except OSError as e:
+                logger.error(f"删除关键词索引{path + suffix}失败: {str(e)}")
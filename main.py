@@ -1,5 +1,6 @@
 import os
 import re
+import time
 import asyncio
 from typing import  Optional
 
@@ -14,7 +15,15 @@ from astrbot.core.utils.session_waiter import (
     SessionController,
 )
 
+from pymilvus import connections
+
 from .database_manger import DatabaseManager
+from .snapshot import export_snapshot, load_snapshot, list_snapshots, read_manifest
+from .migration import CollectionMigrator
+from .fusion import merge_topk, reciprocal_rank_fusion
+from .maintenance import RetentionPolicy, parse_group_policies, maintain_collection
+from .backfill import RoundRobinBackfill
+from .lexical import is_keyword_query
 
 
 
@@ -29,18 +38,24 @@ class QQArchaeology(Star):
         self.all_config = config
         self.config = config["plugin_conf"]
         self.database_config=config["Milvus"]
+        self.snapshot_root=os.path.join(self.database_config.get("lite_path") or "data/astrbot_plugin_cyber_archaeology", "snapshots")
 
         self._isinited=False
+        self._ingest_paused=False   # 迁移完成后到重启前不再记录新消息，避免写入即将弃用的一端
 
         self.database_manager:Optional[DatabaseManager]=None
         self.current_model:Optional[str]=None
         self.provider:Optional[Star]=None
         self.dim:Optional[int]=None
+        self._maintenance_task:Optional[asyncio.Task]=None
+        self._catalog_task:Optional[asyncio.Task]=None
 
 
     async def initialize(self):
         """可选择实现异步的插件初始化方法，当实例化该插件类之后会自动调用该方法。"""
         await self._init_attempt()
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+        self._catalog_task = asyncio.create_task(self._catalog_loop())
 
 
     async def _init_attempt(self):
@@ -114,20 +129,114 @@ class QQArchaeology(Star):
         return re.sub(r'[^a-zA-Z0-9]', '_', unified_db_id)
 
 
+    def get_origin(self, unified_msg_origin):
+        """拆分出 (模型, 平台, 群号)，用于登记集合目录"""
+        parts = unified_msg_origin.split(":")
+        return self.current_model, parts[0], parts[-1]
+
+
+    def get_platform_id(self, event: AstrMessageEvent) -> str:
+        """
+        会话来源中的平台实例名，与集合命名和目录登记使用同一来源
+        （get_platform_name返回的是适配器名，可能与之不同）
+        """
+        return event.unified_msg_origin.split(":")[0]
+
+
+    def get_group_origin(self, event: AstrMessageEvent, group_id) -> str:
+        """构造同一平台下指定群的会话来源"""
+        return self.get_platform_id(event)+":"+"GroupMessage"+":"+str(group_id)
+
+
+    async def _snapshot(self, db_id: str, model_name: Optional[str] = None) -> Optional[str]:
+        """在后台线程中导出集合快照"""
+        collection = self.database_manager.get_collection(db_id)
+        lexical = self.database_manager.get_lexical(db_id) if self.config.get("lexical_search", True) else None
+        return await asyncio.to_thread(
+            export_snapshot, collection, db_id, self.snapshot_root,
+            model_name, self.config.get("snapshot_keep", 3), lexical
+        )
+
+
+    async def _maintenance_loop(self):
+        """后台定期执行过期清理与压缩"""
+        while True:
+            await asyncio.sleep(max(1, self.config.get("maintenance_interval", 60)) * 60)
+            if not self._isinited:
+                continue
+            try:
+                await self._run_maintenance()
+            except Exception as e:
+                logger.error(f"后台维护失败: {str(e)}")
+
+
+    async def _catalog_loop(self):
+        """后台定期将集合目录与数据库对账"""
+        while True:
+            if self._isinited:
+                try:
+                    await asyncio.to_thread(self.database_manager.reconcile_catalog)
+                except Exception as e:
+                    logger.error(f"集合目录对账失败: {str(e)}")
+            await asyncio.sleep(max(1, self.config.get("catalog_reconcile_interval", 10)) * 60)
+
+
+    async def _run_maintenance(self) -> int:
+        """按保留策略维护所有集合，返回删除的总条数"""
+        manager = self.database_manager
+        default_policy = RetentionPolicy(
+            self.config.get("retention_max_age_days", 0),
+            self.config.get("retention_max_entities", 0)
+        )
+        group_policies = parse_group_policies(self.config.get("retention_groups", []), default_policy)
+
+        def _maintain(db_id: str, policy: RetentionPolicy, report) -> int:
+            # 在线程中打开并维护，本轮之前未打开的集合维护后释放，避免所有集合常驻内存
+            was_open = db_id in manager.databases
+            collection = manager.get_collection(db_id)
+            try:
+                on_delete = manager.get_lexical(db_id).delete if self.config.get("lexical_search", True) else None
+                return maintain_collection(collection, policy, report, on_delete)
+            finally:
+                if not was_open:
+                    manager.release_collection(db_id)
+
+        deleted = 0
+        for db_id in await asyncio.to_thread(manager.list_collection_names):
+            policy = group_policies.get(db_id.split("_")[-1], default_policy)
+            if not policy.enabled:
+                continue
+
+            def report(status: str, db_id: str = db_id):
+                manager.maintenance_status[db_id] = status
+
+            try:
+                deleted += await asyncio.to_thread(_maintain, db_id, policy, report)
+            except Exception as e:
+                report("维护失败，请检查日志")
+                logger.error(f"维护集合{db_id}失败: {str(e)}")
+        return deleted
+
+
     async def terminate(self):
         """关闭所有数据库连接"""
+        for task in (self._maintenance_task, self._catalog_task):
+            if task is not None:
+                task.cancel()
         self.database_manager.disconnect()
 
 
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
     async def save_history(self, event: AstrMessageEvent):
         """保存群聊历史记录"""
+        if self._ingest_paused:
+            return
         if await self._init_attempt():
             unified_msg_origin = event.unified_msg_origin
 
             db_id = self.get_unified_db_id(unified_msg_origin)
             # logger.info(f"[save_history]db_id:{db_id}")
-            collection = self.database_manager.get_collection(db_id)
+            collection = self.database_manager.get_collection(db_id, self.get_origin(unified_msg_origin))
             try:
 
                 # 获取消息文本
@@ -145,7 +254,9 @@ class QQArchaeology(Star):
 
                 if not embedding:
                     return
-                collection.add(int(event.message_obj.message_id),embedding)
+                collection.add(int(event.message_obj.message_id),embedding,getattr(event.message_obj, "timestamp", None))
+                if self.config.get("lexical_search", True):
+                    self.database_manager.get_lexical(db_id).add(int(event.message_obj.message_id), message)
             except Exception as e:
                 logger.error(f"保存记录失败: {str(e)}")
 
@@ -153,30 +264,52 @@ class QQArchaeology(Star):
 
     @filter.command("search", alias={'考古'})
     async def search_command(self, event: AstrMessageEvent, query: str):
-        """搜索历史记录 示例：/search 关键词"""
+        """搜索历史记录 示例：/search 关键词[|关键词2|...]"""
 
         if await self._init_attempt():
             unified_msg_origin = event.unified_msg_origin
             db_id = self.get_unified_db_id( unified_msg_origin)
-            collection = self.database_manager.get_collection(db_id)  # 获取当前群的会话
+            collection = self.database_manager.get_collection(db_id, self.get_origin(unified_msg_origin))  # 获取当前群的会话
             group_id = event.get_group_id()
 
             if not query:
                 yield event.plain_result("请输入搜索内容")
                 return
 
-            # 获取查询embedding
-            query_embedding = await self.provider.get_embedding_async(query)
-            if not query_embedding:
-                yield event.plain_result("Embedding服务不可用")
+            # 多个查询用|分隔，一次性获取全部embedding并合并为一次搜索请求
+            queries = [q.strip() for q in query.split("|") if q.strip()]
+            if not queries:
+                yield event.plain_result("请输入搜索内容")
                 return
 
-            # 排序并取前K个
-            top_results = collection.similar_search(query_embedding, self.config["top_k"])
+            top_k = self.config["top_k"]
+            results = []
+            if self.config.get("lexical_search", True):
+                lexical = self.database_manager.get_lexical(db_id)
+                # sqlite检索是同步的，放到线程中执行
+                results = await asyncio.to_thread(lambda: [lexical.search(q, top_k) for q in queries])
+
+            # 人名、网址、型号等关键词的命中数足够top_k条时直接用关键词索引的结果，不调用embedding
+            fast_path = (
+                self.config.get("lexical_fast_path", True) and len(queries) == 1
+                and is_keyword_query(queries[0]) and results and len(results[0]) >= top_k
+            )
+            if not fast_path:
+                query_embeddings = await self.provider.get_embeddings_async(queries)
+                if not query_embeddings or len(query_embeddings) != len(queries):
+                    yield event.plain_result("Embedding服务不可用")
+                    return
+                results = collection.similar_search_many(query_embeddings, top_k) + results
+
+            # 排序并取前K个，多个查询及关键词检索的结果用RRF融合
+            top_results = [message_id for message_id, _ in reciprocal_rank_fusion(results, top_k)]
 
             # 构造返回结果
             if not top_results:
-                yield event.plain_result("未找到相关记录")
+                if collection.is_rebuilding:
+                    yield event.plain_result("本群记录正在维护（重建索引），请稍后再试")
+                else:
+                    yield event.plain_result("未找到相关记录")
                 return
 
             from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import AiocqhttpMessageEvent
@@ -205,6 +338,81 @@ class QQArchaeology(Star):
 
         event.stop_event()
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("search_all", alias={'全局考古'})
+    async def search_all_command(self, event: AstrMessageEvent, query: str = None, groups: str = None):
+        """在bot所在的所有群（或指定的群）中搜索历史记录 示例：/search_all 关键词 [群号,群号]"""
+        if await self._init_attempt():
+            if not query:
+                yield event.plain_result("请输入搜索内容")
+                return
+
+            group_ids = None
+            if groups:
+                group_ids = [group.strip() for group in re.split(r"[,，]", groups) if group.strip()]
+            targets = self.database_manager.find_group_collections(self.current_model, self.get_platform_id(event), group_ids)
+            if not targets:
+                yield event.plain_result("未找到可搜索的群聊记录")
+                return
+
+            query_embedding = await self.provider.get_embedding_async(query)
+            if not query_embedding:
+                yield event.plain_result("Embedding服务不可用")
+                return
+
+            top_k = self.config["top_k"]
+            semaphore = asyncio.Semaphore(max(1, self.config.get("search_concurrency", 8)))
+
+            maintaining = []  # 正在重建索引、本次跳过的群
+
+            def _search_group(group_id: str, db_id: str):
+                # get_collection是线程安全的，未打开的集合在各自线程中并发打开
+                collection = self.database_manager.get_collection(db_id)
+                if collection.is_rebuilding:
+                    maintaining.append(group_id)
+                    return []
+                return [((group_id, message_id), score) for message_id, score in collection.similar_search_scored(query_embedding, top_k)]
+
+            async def _search(group_id: str, db_id: str):
+                async with semaphore:
+                    try:
+                        return await asyncio.to_thread(_search_group, group_id, db_id)
+                    except Exception as e:
+                        logger.error(f"搜索群{group_id}失败: {str(e)}")
+                        return []
+
+            results = await asyncio.gather(*[_search(group_id, db_id) for group_id, db_id in targets.items()])
+            top_results = merge_topk(results, top_k)
+            maintaining_note = f"群{','.join(maintaining)}正在维护（重建索引），本次未检索" if maintaining else ""
+            if not top_results:
+                yield event.plain_result(maintaining_note or "未找到相关记录")
+                return
+
+            from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import AiocqhttpMessageEvent
+            assert isinstance(event, AiocqhttpMessageEvent)
+            client = event.bot
+
+            async def _get_text(message_id: int) -> str:
+                try:
+                    ret = await client.api.call_action("get_msg", message_id=message_id)
+                    return "".join(part["data"].get("text", "") for part in ret.get("message", []) if part["type"] == "text")
+                except Exception as e:
+                    logger.error(f"获取消息{message_id}失败: {str(e)}")
+                    return f"消息{message_id}"
+
+            texts = await asyncio.gather(*[_get_text(message_id) for (_, message_id), _ in top_results])
+            lines = [
+                f"第{k + 1}相似 群{group_id} ({score:.3f})：{text}"
+                for k, (((group_id, _), score), text) in enumerate(zip(top_results, texts))
+            ]
+            if maintaining_note:
+                lines.append(maintaining_note)
+            yield event.plain_result("\n".join(lines))
+        else:
+            yield event.plain_result("插件未成功启动")
+
+        event.stop_event()
+
     @filter.command_group("cyber_archaeology",alias={'ca'})
     def cyber_archaeology(self):
         pass
@@ -224,6 +432,9 @@ class QQArchaeology(Star):
                 if event.is_admin():
                     if event.message_str == "YES" or event.message_str == "yes" or event.message_str == "y":
                         try:
+                            if self.config.get("snapshot_before_clear", True):
+                                for db_id in self.database_manager.list_collection_names():
+                                    await self._snapshot(db_id)
                             self.database_manager.clear()
                             await event.send(MessageChain().message("所有群历史记录已清空"))  
                         except Exception as e:
@@ -261,8 +472,10 @@ class QQArchaeology(Star):
                 if group_id is None:
                     unified_msg_origin = event.unified_msg_origin
                 else:
-                    unified_msg_origin = event.get_platform_name()+":"+"GroupMessage"+":"+str(group_id)
+                    unified_msg_origin = self.get_group_origin(event, group_id)
                 db_id = self.get_unified_db_id(unified_msg_origin)
+                if self.config.get("snapshot_before_clear", True) and await asyncio.to_thread(self.database_manager.has_collection, db_id):
+                    await self._snapshot(db_id, self.current_model)
                 self.database_manager.clear_collection(db_id)
 
                 group_id=unified_msg_origin.split(":")[-1]
@@ -275,6 +488,71 @@ class QQArchaeology(Star):
             yield event.plain_result("插件未成功启动")
 
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @cyber_archaeology.command("export", alias={'导出快照'})
+    async def export_command(self, event: AstrMessageEvent, group_id:int=None):
+        """导出当前群聊（或指定群）记录的快照 示例：/ca export [群号:int]"""
+        if await self._init_attempt():
+            try:
+                if group_id is None:
+                    unified_msg_origin = event.unified_msg_origin
+                else:
+                    unified_msg_origin = self.get_group_origin(event, group_id)
+                db_id = self.get_unified_db_id(unified_msg_origin)
+                if not await asyncio.to_thread(self.database_manager.has_collection, db_id):
+                    yield event.plain_result("未找到指定群号的历史记录")
+                    return
+                snapshot_dir = await self._snapshot(db_id, self.current_model)
+                if snapshot_dir is None:
+                    yield event.plain_result("记录为空，无需导出")
+                else:
+                    yield event.plain_result(f"快照导出成功：{os.path.basename(snapshot_dir)}")
+            except Exception as e:
+                logger.error(f"导出快照失败: {str(e)}")
+                yield event.plain_result("导出快照失败，请检查日志")
+        else:
+            yield event.plain_result("插件未成功启动")
+
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @cyber_archaeology.command("import_snapshot", alias={'恢复快照'})
+    async def import_snapshot_command(self, event: AstrMessageEvent, group_id:int=None, name:str=None):
+        """从快照恢复当前群聊（或指定群）记录 示例：/ca import_snapshot [群号:int] [快照名]"""
+        if await self._init_attempt():
+            try:
+                if group_id is None:
+                    unified_msg_origin = event.unified_msg_origin
+                else:
+                    unified_msg_origin = self.get_group_origin(event, group_id)
+                db_id = self.get_unified_db_id(unified_msg_origin)
+                snapshots = list_snapshots(self.snapshot_root, db_id)
+                if not snapshots:
+                    yield event.plain_result("未找到该群的快照")
+                    return
+                if name is None:
+                    name = snapshots[-1]
+                elif name not in snapshots:
+                    yield event.plain_result("快照不存在，可用快照：\n" + "\n".join(snapshots))
+                    return
+
+                collection = self.database_manager.get_collection(db_id, self.get_origin(unified_msg_origin))
+                snapshot_dir = os.path.join(self.snapshot_root, db_id, name)
+                lexical = self.database_manager.get_lexical(db_id) if self.config.get("lexical_search", True) else None
+                restored = await asyncio.to_thread(
+                    load_snapshot, collection, snapshot_dir,
+                    self.dim, self.current_model, lexical
+                )
+                reply = f"已从快照{name}恢复{restored}条记录"
+                if lexical is not None and not read_manifest(snapshot_dir).get("lexical"):
+                    reply += "\n该快照不含关键词索引，关键词检索需重新导入历史消息(/ca load_history)后才能恢复"
+                yield event.plain_result(reply)
+            except Exception as e:
+                logger.error(f"恢复快照失败: {str(e)}")
+                yield event.plain_result("恢复快照失败，请检查日志")
+        else:
+            yield event.plain_result("插件未成功启动")
+
+
     async def load_history_from_aiocqhttp(self, event: AstrMessageEvent, count: int, seq: int ,group_id:int):
         """读取插件未安装前bot所保存的历史数据当前群聊记录 示例：/ca load_history <读取消息条数:int> [初始消息序号:int]"""
         from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import AiocqhttpMessageEvent
@@ -302,9 +580,11 @@ class QQArchaeology(Star):
 
         chat_list = []
         message_id_list = []
+        timestamp_list = []
 
+        # 整页一次批量查询已存在的消息，放到线程中执行，避免逐条RPC阻塞事件循环
+        existing = await asyncio.to_thread(collection.exists_many, [msg['message_id'] for msg in messages])
 
-        
         for msg in messages:
             # 解析发送者信息
             sender = msg.get('sender', {})
@@ -313,7 +593,7 @@ class QQArchaeology(Star):
             if int(myid) == sender.get('user_id', ""):
                 continue
 
-            if collection.exists(message_id):
+            if int(message_id) in existing:
                 continue
             # 提取所有文本内容（兼容多段多类型文本消息）
             message_text_chain = []
@@ -328,11 +608,12 @@ class QQArchaeology(Star):
                 continue
             chat_list.append(message_text)
             message_id_list.append(message_id)
+            timestamp_list.append(msg.get('time') or int(time.time()))
         
 
 
         
-        return  chat_list,message_id_list
+        return  chat_list,message_id_list,timestamp_list
 
 
 
@@ -350,7 +631,7 @@ class QQArchaeology(Star):
             try:
                 unified_msg_origin = event.unified_msg_origin
                 db_id = self.get_unified_db_id(unified_msg_origin)
-                collection = self.database_manager.get_collection(db_id)
+                collection = self.database_manager.get_collection(db_id, self.get_origin(unified_msg_origin))
             except Exception as e:
                 logger.error(f"获取群聊记录失败: {str(e)}")
                 yield event.plain_result("获取群聊记录失败，请检查日志")
@@ -372,7 +653,7 @@ class QQArchaeology(Star):
                     return
                 myid=event.get_self_id()
 
-                chat_list,message_id_list = await self.format_history_from_aiocqhttp(messages, myid, collection)
+                chat_list,message_id_list,timestamp_list = await self.format_history_from_aiocqhttp(messages, myid, collection)
                 logger.info(f"成功读取{len(chat_list)}条群聊历史记录")
                 if not chat_list:
                     yield event.plain_result("没有可导入的聊天记录")
@@ -392,7 +673,9 @@ class QQArchaeology(Star):
                     logger.error(f"生成的embedding数量为{len(embeddings)}")
                     raise ValueError("读取的历史记录数量与生成的embedding数量不一致")
                 logger.info(f"成功生成embeddings")
-                collection.add_list(message_id_list, embeddings)
+                collection.add_list(message_id_list, embeddings, timestamps=timestamp_list)
+                if self.config.get("lexical_search", True):
+                    self.database_manager.get_lexical(db_id).add_many(message_id_list, chat_list)
 
                 yield event.plain_result(f"成功导入{len(chat_list)}条群聊历史记录")
             except Exception as e:
@@ -417,9 +700,9 @@ class QQArchaeology(Star):
                 event.stop_event()
                 return
             try:
-                unified_msg_origin = event.get_platform_name()+":"+"GroupMessage"+":"+str(group_id)
+                unified_msg_origin = self.get_group_origin(event, group_id)
                 db_id = self.get_unified_db_id(unified_msg_origin)
-                collection = self.database_manager.get_collection(db_id)
+                collection = self.database_manager.get_collection(db_id, self.get_origin(unified_msg_origin))
             except Exception as e:
                 logger.error(f"获取群聊记录失败: {str(e)}")
                 yield event.plain_result("获取群聊记录失败，请检查日志")
@@ -441,7 +724,7 @@ class QQArchaeology(Star):
                     return
                 myid=event.get_self_id()
 
-                chat_list,message_id_list = await self.format_history_from_aiocqhttp(messages, myid, collection)
+                chat_list,message_id_list,timestamp_list = await self.format_history_from_aiocqhttp(messages, myid, collection)
                 
                 logger.info(f"成功读取{len(chat_list)}条群聊历史记录")
                 if not chat_list:
@@ -462,7 +745,9 @@ class QQArchaeology(Star):
                     logger.error(f"生成的embedding数量为{len(embeddings)}")
                     raise ValueError("读取的历史记录数量与生成的embedding数量不一致")
                 logger.info(f"成功生成embeddings")
-                collection.add_list(message_id_list, embeddings)
+                collection.add_list(message_id_list, embeddings, timestamps=timestamp_list)
+                if self.config.get("lexical_search", True):
+                    self.database_manager.get_lexical(db_id).add_many(message_id_list, chat_list)
 
                 yield event.plain_result(f"成功导入{len(chat_list)}条群聊历史记录")
             except Exception as e:
@@ -472,6 +757,175 @@ class QQArchaeology(Star):
             yield event.plain_result("插件未成功启动")
 
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @cyber_archaeology.command("load_all_groups", alias={'lag'})
+    async def load_all_groups_command(self, event: AstrMessageEvent, count: int = None):
+        """并发导入bot所在所有群的历史消息 示例：/ca load_all_groups <每个群读取消息条数:int>"""
+        if await self._init_attempt():
+            if count is None:
+                yield event.plain_result("未传入要导入的聊天记录数量")
+                event.stop_event()
+                return
+
+            from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import AiocqhttpMessageEvent
+            assert isinstance(event, AiocqhttpMessageEvent)
+            client = event.bot
+            try:
+                ret = await client.api.call_action("get_group_list")
+                group_list = ret.get("data", []) if isinstance(ret, dict) else ret
+                group_ids = [str(group["group_id"]) for group in group_list]
+            except Exception as e:
+                logger.error(f"获取群列表失败: {str(e)}")
+                yield event.plain_result("获取群列表失败，请检查日志")
+                return
+            if not group_ids:
+                yield event.plain_result("bot没有加入任何群")
+                return
+
+            myid = event.get_self_id()
+
+            async def fetch_page(group_id: str, seq: int, page_size: int):
+                return await self.load_history_from_aiocqhttp(event, page_size, seq, int(group_id))
+
+            async def prepare_page(group_id: str, messages: list):
+                unified_msg_origin = self.get_group_origin(event, group_id)
+                db_id = self.get_unified_db_id(unified_msg_origin)
+                collection = self.database_manager.get_collection(db_id, self.get_origin(unified_msg_origin))
+                chat_list,message_id_list,timestamp_list = await self.format_history_from_aiocqhttp(messages, myid, collection)
+                return db_id, collection, chat_list, message_id_list, timestamp_list
+
+            async def import_page(group_id: str, prepared) -> int:
+                db_id, collection, chat_list, message_id_list, timestamp_list = prepared
+                if not chat_list:
+                    return 0
+                embeddings = await self.provider.get_embeddings_async(chat_list)
+                if len(embeddings) != len(chat_list):
+                    raise ValueError("读取的历史记录数量与生成的embedding数量不一致")
+                await asyncio.to_thread(collection.add_list, message_id_list, embeddings, timestamps=timestamp_list)
+                if self.config.get("lexical_search", True):
+                    await asyncio.to_thread(self.database_manager.get_lexical(db_id).add_many, message_id_list, chat_list)
+                return len(chat_list)
+
+            backfill = RoundRobinBackfill(
+                group_ids, count, self.config.get("backfill_page_size", 200),
+                fetch_page, import_page, prepare_page,
+                onebot_limit=self.config.get("backfill_onebot_concurrency", 4),
+                embed_limit=self.config.get("backfill_embedding_concurrency", 2)
+            )
+            yield event.plain_result(f"开始导入{len(group_ids)}个群的历史消息，完成后会发送报告")
+            await backfill.run()
+            yield event.plain_result(backfill.report())
+        else:
+            yield event.plain_result("插件未成功启动")
+
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @cyber_archaeology.command("migrate", alias={'迁移'})
+    async def migrate_command(self, event: AstrMessageEvent, direction: str = None, parallel: int = 4):
+        """在lite与服务器模式之间迁移所有记录 示例：/ca migrate <to_server|to_lite> [并发数:int]"""
+        if direction not in ("to_server", "to_lite"):
+            yield event.plain_result("请指定迁移方向：to_server 或 to_lite")
+            return
+        if await self._init_attempt():
+            if self.database_manager.backend == "numpy":
+                yield event.plain_result("numpy后端不支持迁移")
+                return
+            if self.database_manager.sharded:
+                yield event.plain_result("分片模式请使用/ca rebalance")
+                return
+            to_server = direction == "to_server"
+            src_alias, dst_alias = "ca_migrate_src", "ca_migrate_dst"
+            try:
+                self.database_manager.connect_alias(src_alias, islite=to_server)
+                self.database_manager.connect_alias(dst_alias, islite=not to_server)
+                migrator = CollectionMigrator(
+                    src_alias, dst_alias,
+                    os.path.join(self.database_config.get("lite_path") or "data/astrbot_plugin_cyber_archaeology", f"migration_{direction}.json"),
+                    parallel=parallel
+                )
+                yield event.plain_result("迁移开始，完成后会发送报告")
+                results = await migrator.run()
+                if not any(isinstance(result, Exception) for result in results.values()):
+                    # message_id不单调，按主键续传会漏掉复制期间写入的记录：先暂停记录新消息，再按主键对比补齐
+                    self._ingest_paused = True
+                    caught_up = await migrator.run_catch_up(list(results))
+                    for name, result in caught_up.items():
+                        results[name] = result if isinstance(result, Exception) else results[name] + result
+            except Exception as e:
+                self._ingest_paused = False
+                logger.error(f"迁移失败: {str(e)}")
+                yield event.plain_result("迁移失败，请检查日志，重新执行命令可从断点继续")
+                return
+            finally:
+                for alias in (src_alias, dst_alias):
+                    try:
+                        connections.disconnect(alias)
+                    except Exception:
+                        pass
+
+            failed = [name for name, result in results.items() if isinstance(result, Exception)]
+            total = sum(result for result in results.values() if not isinstance(result, Exception))
+            lines = [f"迁移完成：{len(results) - len(failed)}/{len(results)}个集合，共{total}条记录"]
+            if failed:
+                self._ingest_paused = False
+                lines.append("失败的集合（重新执行命令可从断点继续）：")
+                lines.extend(failed)
+            else:
+                migrator.clear_progress()
+                lines.append(f"已暂停记录新消息，请在插件配置中将islite设置为{'false' if to_server else 'true'}后执行/ca restart，重启后恢复记录")
+                lines.append("暂停期间的消息可在重启后用/ca load_history补录")
+            yield event.plain_result("\n".join(lines))
+        else:
+            yield event.plain_result("插件未成功启动")
+
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @cyber_archaeology.command("rebalance", alias={'重平衡'})
+    async def rebalance_command(self, event: AstrMessageEvent, parallel: int = 4):
+        """新增服务器后把集合迁移到其归属分片 示例：/ca rebalance [并发数:int]"""
+        if await self._init_attempt():
+            if not self.database_manager.sharded:
+                yield event.plain_result("未配置servers，无需重平衡")
+                return
+            yield event.plain_result("重平衡开始，完成后会发送报告")
+            try:
+                results = await self.database_manager.rebalance(
+                    self.database_config.get("lite_path") or "data/astrbot_plugin_cyber_archaeology",
+                    parallel=parallel
+                )
+            except Exception as e:
+                logger.error(f"重平衡失败: {str(e)}")
+                yield event.plain_result("重平衡失败，请检查日志，重新执行命令可从断点继续")
+                return
+            if not results:
+                yield event.plain_result("所有集合都已在归属分片上")
+                return
+            failed = [name for name, result in results.items() if isinstance(result, Exception)]
+            total = sum(result for result in results.values() if not isinstance(result, Exception))
+            lines = [f"重平衡完成：迁移{len(results) - len(failed)}/{len(results)}个集合，共{total}条记录"]
+            if failed:
+                lines.append("失败的集合（重新执行命令可从断点继续）：")
+                lines.extend(failed)
+            yield event.plain_result("\n".join(lines))
+        else:
+            yield event.plain_result("插件未成功启动")
+
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @cyber_archaeology.command("maintain", alias={'维护'})
+    async def maintain_command(self, event: AstrMessageEvent):
+        """立即按保留策略清理过期记录并压缩 示例：/ca maintain"""
+        if await self._init_attempt():
+            try:
+                deleted = await self._run_maintenance()
+                yield event.plain_result(f"维护完成，共清理{deleted}条过期记录")
+            except Exception as e:
+                logger.error(f"维护失败: {str(e)}")
+                yield event.plain_result("维护失败，请检查日志")
+        else:
+            yield event.plain_result("插件未成功启动")
+
+
     @filter.permission_type(filter.PermissionType.ADMIN)
     @cyber_archaeology.command("restart")
     async def restart(self, event: AstrMessageEvent):
@@ -479,6 +933,7 @@ class QQArchaeology(Star):
         try:
             await self._init()
             self._isinited = True
+            self._ingest_paused = False
             yield event.plain_result("插件重启成功")
         except Exception as e:
             self._isinited = False
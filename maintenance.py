@@ -0,0 +1,135 @@
+"""
+maintenance.py
+"""
+import time
+from typing import List, Dict, Optional, Callable
+
+import numpy as np
+from astrbot.api import logger
+
+from .database import Database
+
+DELETE_BATCH_SIZE = 1000    # 每次delete请求的message_id数量
+REBUILD_INDEX_RATIO = 0.2   # 删除超过该比例的记录后重建索引
+
+
+class RetentionPolicy:
+    """单个群的保留策略，0表示不限制"""
+
+    def __init__(self, max_age_days: int = 0, max_entities: int = 0):
+        self.max_age_days = max(0, int(max_age_days or 0))
+        self.max_entities = max(0, int(max_entities or 0))
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age_days > 0 or self.max_entities > 0
+
+    def __str__(self) -> str:
+        parts = []
+        if self.max_age_days:
+            parts.append(f"{self.max_age_days}天")
+        if self.max_entities:
+            parts.append(f"{self.max_entities}条")
+        return "/".join(parts) or "不限制"
+
+
+def parse_group_policies(entries: List[str], default: RetentionPolicy) -> Dict[str, RetentionPolicy]:
+    """
+    解析按群配置的保留策略
+    :param entries: 形如 "群号:天数:条数" 的字符串，留空的项沿用全局默认
+    :return: {群号: RetentionPolicy}
+    """
+    policies = {}
+    for entry in entries or []:
+        parts = [part.strip() for part in str(entry).replace("：", ":").split(":")]
+        if not parts[0]:
+            continue
+        try:
+            max_age_days = int(parts[1]) if len(parts) > 1 and parts[1] else default.max_age_days
+            max_entities = int(parts[2]) if len(parts) > 2 and parts[2] else default.max_entities
+        except ValueError:
+            logger.error(f"无法解析保留策略: {entry}")
+            continue
+        policies[parts[0]] = RetentionPolicy(max_age_days, max_entities)
+    return policies
+
+
+def collect_expired(collection: Database, policy: RetentionPolicy, now: Optional[int] = None) -> List[int]:
+    """找出超过保留期限或超出条数上限的message_id（按时间从旧到新淘汰）"""
+    id_batches, ts_batches = [], []
+    for message_ids, timestamps in collection.iter_timestamps():
+        id_batches.append(np.asarray(message_ids, dtype=np.int64))
+        ts_batches.append(np.asarray(timestamps, dtype=np.int64))
+    if not id_batches:
+        return []
+    ids = np.concatenate(id_batches)
+    ts = np.concatenate(ts_batches)
+
+    expired = np.zeros(len(ids), dtype=bool)
+    if policy.max_age_days:
+        cutoff = (now or int(time.time())) - policy.max_age_days * 86400
+        # 时间为0表示未知，不按时间淘汰
+        expired |= (ts > 0) & (ts < cutoff)
+    if policy.max_entities:
+        remaining = np.flatnonzero(~expired)
+        excess = len(remaining) - policy.max_entities
+        if excess > 0:
+            oldest = remaining[np.argpartition(ts[remaining], excess - 1)[:excess]]
+            expired[oldest] = True
+    return ids[expired].tolist()
+
+
+def maintain_collection(collection: Database, policy: RetentionPolicy,
+                        report: Callable[[str], None] = lambda status: None,
+                        on_delete: Optional[Callable[[List[int]], None]] = None) -> int:
+    """
+    对单个集合执行一次维护：分批删除过期记录、compact，必要时重建索引
+    :param report: 进度回调，参数为状态描述
+    :param on_delete: 每批删除后的回调，用于同步删除关键词索引
+    :return: 删除的条数
+    """
+    if not policy.enabled:
+        return 0
+    if not collection.supports_retention:
+        report("旧集合没有时间字段，跳过")
+        return 0
+    # 后台任务与/ca maintain可能同时维护同一集合
+    if not collection.maintenance_lock.acquire(blocking=False):
+        logger.info("[maintenance]集合正在维护中，跳过")
+        return 0
+    try:
+        return _maintain_locked(collection, policy, report, on_delete)
+    finally:
+        collection.maintenance_lock.release()
+
+
+def _maintain_locked(collection: Database, policy: RetentionPolicy,
+                     report: Callable[[str], None],
+                     on_delete: Optional[Callable[[List[int]], None]]) -> int:
+    report("扫描中")
+    total = collection.count()
+    expired = collect_expired(collection, policy)
+    if not expired:
+        report(f"无过期记录 ({time.strftime('%m-%d %H:%M')})")
+        return 0
+
+    for start in range(0, len(expired), DELETE_BATCH_SIZE):
+        batch = expired[start:start + DELETE_BATCH_SIZE]
+        collection.delete(batch)
+        if on_delete is not None:
+            on_delete(batch)
+        report(f"删除中 {min(start + DELETE_BATCH_SIZE, len(expired))}/{len(expired)}")
+
+    report("压缩中")
+    try:
+        collection.compact()
+    except Exception as e:
+        # Milvus Lite 等环境可能不支持手动compact
+        logger.warning(f"[maintenance]compact失败: {str(e)}")
+
+    if total and len(expired) / total >= REBUILD_INDEX_RATIO:
+        report("重建索引中")
+        collection.rebuild_index()
+
+    report(f"已清理{len(expired)}条 ({time.strftime('%m-%d %H:%M')})")
+    return len(expired)
@@ -0,0 +1,201 @@
+"""
+migration.py
+"""
+import os
+import json
+import asyncio
+import threading
+from typing import List, Dict, Optional, Set
+
+from pymilvus import utility, Collection, CollectionSchema, DataType
+from astrbot.api import logger
+
+
+class CollectionMigrator:
+    """在两个连接别名之间流式复制collection（保留schema与索引，可断点续传）"""
+
+    def __init__(self, src_alias: str, dst_alias: str, progress_path: str,
+                 read_batch_size: int = 2000, write_batch_size: int = 20000, parallel: int = 4,
+                 upsert: bool = False):
+        """
+        :param upsert: 始终用upsert写入目标端（目标端在复制期间也有新写入时使用）
+        """
+        self.src_alias = src_alias
+        self.dst_alias = dst_alias
+        self.progress_path = progress_path
+        self.read_batch_size = read_batch_size
+        self.write_batch_size = write_batch_size
+        self.parallel = max(1, parallel)
+        self.upsert = upsert
+        self._lock = threading.Lock()
+        self.progress: Dict[str, dict] = self._load_progress()
+
+    def _load_progress(self) -> Dict[str, dict]:
+        if os.path.isfile(self.progress_path):
+            with open(self.progress_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def _save_progress(self, name: str, state: dict) -> None:
+        with self._lock:
+            self.progress[name] = state
+            tmp_path = self.progress_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.progress, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.progress_path)
+
+    def _prepare_target(self, name: str, src: Collection) -> Collection:
+        """在目标端按源端的schema和索引参数建表"""
+        if utility.has_collection(name, using=self.dst_alias):
+            return Collection(name, using=self.dst_alias)
+        schema = CollectionSchema(src.schema.fields, description=src.schema.description)
+        dst = Collection(name, schema, using=self.dst_alias)
+        for index in src.indexes:
+            dst.create_index(field_name=index.field_name, index_params=index.params)
+        logger.info(f"[migrate]已在目标端创建集合 {name}")
+        return dst
+
+    def prepare(self, name: str) -> None:
+        """只在目标端建表，不复制数据"""
+        self._prepare_target(name, Collection(name, using=self.src_alias))
+
+    def migrate_collection(self, name: str) -> int:
+        """复制单个collection，返回累计复制的条数"""
+        state = dict(self.progress.get(name, {}))
+        if state.get("done"):
+            return state.get("copied", 0)
+
+        src = Collection(name, using=self.src_alias)
+        src.load()
+        target_existed = utility.has_collection(name, using=self.dst_alias)
+        dst = self._prepare_target(name, src)
+
+        # 没有进度记录但目标端已有数据时改用upsert，避免重复主键
+        if self.upsert or (not state and target_existed and dst.num_entities > 0):
+            state["upsert"] = True
+        write = dst.upsert if state.get("upsert") else dst.insert
+
+        pk_field = src.schema.primary_field
+        output_fields = [field.name for field in src.schema.fields]
+        expr = ""
+        last_pk = state.get("last_pk")
+        if last_pk is not None:
+            if pk_field.dtype == DataType.VARCHAR:
+                expr = f'{pk_field.name} > "{last_pk}"'
+            else:
+                expr = f"{pk_field.name} > {last_pk}"
+
+        copied = state.get("copied", 0)
+        buffer = []
+
+        def _write_buffer():
+            nonlocal copied, buffer
+            write(buffer)
+            dst.flush()
+            copied += len(buffer)
+            state.update({"copied": copied, "last_pk": max(row[pk_field.name] for row in buffer)})
+            self._save_progress(name, state)
+            buffer = []
+
+        # query_iterator按主键升序分页，last_pk即为续传位置
+        iterator = src.query_iterator(
+            batch_size=self.read_batch_size,
+            expr=expr,
+            output_fields=output_fields
+        )
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                buffer.extend(rows)
+                if len(buffer) >= self.write_batch_size:
+                    _write_buffer()
+        finally:
+            iterator.close()
+        if buffer:
+            _write_buffer()
+
+        state.update({"copied": copied, "done": True})
+        self._save_progress(name, state)
+        if dst.num_entities < src.num_entities:
+            logger.warning(f"[migrate]{name}目标端条数{dst.num_entities}少于源端{src.num_entities}")
+        logger.info(f"[migrate]{name}迁移完成，共{copied}条")
+        return copied
+
+    async def run(self, names: Optional[List[str]] = None) -> Dict[str, object]:
+        """并发迁移多个collection，返回 {集合名: 条数或异常}"""
+        if names is None:
+            names = utility.list_collections(using=self.src_alias)
+        semaphore = asyncio.Semaphore(self.parallel)
+
+        async def _one(name: str):
+            async with semaphore:
+                return await asyncio.to_thread(self.migrate_collection, name)
+
+        results = await asyncio.gather(*[_one(name) for name in names], return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.error(f"[migrate]{name}迁移失败: {str(result)}")
+        return dict(zip(names, results))
+
+    def _primary_keys(self, collection: Collection) -> Set:
+        pk_name = collection.schema.primary_field.name
+        keys = set()
+        iterator = collection.query_iterator(batch_size=self.write_batch_size, output_fields=[pk_name])
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                keys.update(row[pk_name] for row in rows)
+        finally:
+            iterator.close()
+        return keys
+
+    def catch_up(self, name: str) -> int:
+        """
+        按主键对比两端，补齐源端有而目标端没有的记录
+        message_id不随时间递增，复制期间新写入的记录可能落在已读过的主键区间，按last_pk续传会漏掉
+        :return: 补齐的条数
+        """
+        src = Collection(name, using=self.src_alias)
+        src.load()
+        dst = Collection(name, using=self.dst_alias)
+        dst.load()
+        missing = sorted(self._primary_keys(src) - self._primary_keys(dst))
+        if not missing:
+            return 0
+        pk_field = src.schema.primary_field
+        output_fields = [field.name for field in src.schema.fields]
+        for start in range(0, len(missing), self.read_batch_size):
+            batch = missing[start:start + self.read_batch_size]
+            if pk_field.dtype == DataType.VARCHAR:
+                keys = ",".join(json.dumps(key, ensure_ascii=False) for key in batch)
+            else:
+                keys = ",".join(str(key) for key in batch)
+            rows = src.query(expr=f"{pk_field.name} in [{keys}]", output_fields=output_fields)
+            if rows:
+                dst.upsert(rows)
+        dst.flush()
+        logger.info(f"[migrate]{name}补齐{len(missing)}条复制期间新增的记录")
+        return len(missing)
+
+    async def run_catch_up(self, names: List[str]) -> Dict[str, object]:
+        """并发补齐多个collection，返回 {集合名: 补齐条数或异常}"""
+        semaphore = asyncio.Semaphore(self.parallel)
+
+        async def _one(name: str):
+            async with semaphore:
+                return await asyncio.to_thread(self.catch_up, name)
+
+        results = await asyncio.gather(*[_one(name) for name in names], return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.error(f"[migrate]{name}补齐失败: {str(result)}")
+        return dict(zip(names, results))
+
+    def clear_progress(self) -> None:
+        """全部迁移成功后删除进度文件"""
+        if os.path.isfile(self.progress_path):
+            os.remove(self.progress_path)
@@ -0,0 +1,351 @@
+"""
+numpy_database.py
+"""
+import os
+import json
+import time
+import shutil
+import threading
+from typing import List, Dict, Optional, Iterator, Tuple, Set
+
+import numpy as np
+from astrbot.api import logger
+
+from .database import Database
+
+SEARCH_BLOCK_SIZE = 65536  # 暴力搜索时每次参与矩阵乘法的向量条数
+
+
+class NumpyCollection(Database):
+    """
+    基于内存映射文件的本地向量存储，无需Milvus进程
+    每个集合一个目录：
+        vectors.bin  按行追加的归一化向量（float32/float16）
+        ids.bin      与向量逐行对应的int64 message_id
+        ts.bin       与向量逐行对应的int64 消息时间
+        deleted.bin  已删除的行号
+        meta.json    维度、精度和已提交的行数
+    写入时先追加数据并fsync，再原子替换meta.json，崩溃后未提交的尾部会在下次打开时截断
+    删除只记录行号，compact时再重写数据文件
+    """
+
+    def __init__(self, config, fields):
+        super().__init__(config, fields)
+        self.collection_name = config.get("collection_name", "message_embeddings")
+        self.root = config["numpy_root"]
+        self.dim = config["dim"]
+        self.dtype = np.dtype(config.get("numpy_dtype") or "float32")
+        self.path = os.path.join(self.root, self.collection_name)
+        self._lock = threading.RLock()
+        self._init_collection()
+
+    @staticmethod
+    def list_names(root: str) -> List[str]:
+        if not os.path.isdir(root):
+            return []
+        return sorted(
+            name for name in os.listdir(root)
+            if os.path.isfile(os.path.join(root, name, "meta.json"))
+        )
+
+    @staticmethod
+    def read_stats(root: str, name: str) -> Tuple[int, int]:
+        """
+        不打开集合，直接从文件读取 (条数, 占用字节数)
+        只读不加锁，用于后台对账
+        """
+        path = os.path.join(root, name)
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            rows = json.load(f)["count"]
+        ids = np.fromfile(os.path.join(path, "ids.bin"), dtype=np.int64, count=rows) if rows else np.empty(0, dtype=np.int64)
+        deleted_rows = np.empty(0, dtype=np.int64)
+        if os.path.isfile(os.path.join(path, "deleted.bin")):
+            deleted_rows = np.fromfile(os.path.join(path, "deleted.bin"), dtype=np.int64)
+        # 每个message_id以最后一次写入的行为准，该行未被删除才计数
+        _, last_index = np.unique(ids[::-1], return_index=True)
+        latest_rows = len(ids) - 1 - last_index
+        count = int(np.count_nonzero(~np.isin(latest_rows, deleted_rows)))
+        size = sum(
+            os.path.getsize(os.path.join(path, file_name))
+            for file_name in ("vectors.bin", "ids.bin", "ts.bin", "deleted.bin")
+            if os.path.isfile(os.path.join(path, file_name))
+        )
+        return count, size
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _recover_compaction(self) -> None:
+        """处理compact中途崩溃留下的目录"""
+        compact_path, old_path = self.path + ".compact", self.path + ".old"
+        if os.path.isdir(compact_path):
+            if os.path.isdir(self.path):
+                # 新目录未完成替换，丢弃
+                shutil.rmtree(compact_path, ignore_errors=True)
+            else:
+                os.replace(compact_path, self.path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    def _init_collection(self) -> None:
+        self._recover_compaction()
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.isfile(self._file("meta.json")):
+            with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+            self.rows = meta["count"]
+        else:
+            self.rows = 0
+            self._write_meta()
+            logger.info(f"[_init_collection]{self.collection_name}向量维度为{self.dim}，精度为{self.dtype.name}")
+
+        if not os.path.isfile(self._file("ts.bin")):
+            # 没有时间文件的旧集合，时间记为0（不参与按时间过期）
+            with open(self._file("ts.bin"), "wb") as f:
+                f.truncate(self.rows * 8)
+
+        # 截断崩溃时写了一半、尚未提交的尾部
+        for name, row_size in (("ids.bin", 8), ("ts.bin", 8), ("vectors.bin", self.dim * self.dtype.itemsize)):
+            with open(self._file(name), "ab") as f:
+                f.truncate(self.rows * row_size)
+
+        self._ids = self._read_int64("ids.bin", self.rows)
+        self._ts = self._read_int64("ts.bin", self.rows)
+        self._row_of: Dict[int, int] = {}
+        self._stale = np.zeros(self.rows, dtype=bool)
+        for row, message_id in enumerate(self._ids.tolist()):
+            self._mark(message_id, row)
+
+        deleted_rows = np.empty(0, dtype=np.int64)
+        if os.path.isfile(self._file("deleted.bin")):
+            deleted_rows = np.fromfile(self._file("deleted.bin"), dtype=np.int64)
+        self._deleted_count = 0
+        for row in deleted_rows.tolist():
+            if row < self.rows and not self._stale[row]:
+                self._stale[row] = True
+                self._row_of.pop(int(self._ids[row]), None)
+                self._deleted_count += 1
+        self._vectors: Optional[np.memmap] = None
+
+    def _write_meta(self, path: Optional[str] = None, rows: Optional[int] = None) -> None:
+        path = path or self.path
+        tmp_path = os.path.join(path, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "count": self.rows if rows is None else rows}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(path, "meta.json"))
+
+    def _read_int64(self, name: str, count: int) -> np.ndarray:
+        if count == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.fromfile(self._file(name), dtype=np.int64, count=count)
+
+    def _mark(self, message_id: int, row: int) -> None:
+        """记录message_id的最新行号，被覆盖的旧行标记为失效"""
+        old_row = self._row_of.get(message_id)
+        if old_row is not None:
+            self._stale[old_row] = True
+        self._row_of[message_id] = row
+
+    def _vector_view(self) -> np.ndarray:
+        if self.rows == 0:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        if self._vectors is None or self._vectors.shape[0] != self.rows:
+            self._vectors = np.memmap(self._file("vectors.bin"), dtype=self.dtype, mode="r", shape=(self.rows, self.dim))
+        return self._vectors
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def add(self, message_id: int, embedding: List[float], timestamp: Optional[int] = None) -> None:
+        self.add_list([message_id], [embedding], timestamps=None if timestamp is None else [timestamp])
+
+    def add_list(self, message_ids: List[int], embeddings: List[List[float]], flush: bool = True,
+                 timestamps: Optional[List[int]] = None) -> None:
+        if not message_ids:
+            return
+        vectors = self._normalize(embeddings).astype(self.dtype)
+        if vectors.shape != (len(message_ids), self.dim):
+            raise ValueError(f"向量维度应为{self.dim}，实际为{vectors.shape[1]}")
+        ids = np.asarray(message_ids, dtype=np.int64)
+        if timestamps is None:
+            timestamps = [int(time.time())] * len(message_ids)
+        ts = np.asarray(timestamps, dtype=np.int64)
+
+        with self._lock:
+            # 从已提交的位置写起，覆盖之前失败写入残留的尾部
+            for name, data, row_size in (("vectors.bin", vectors, self.dim * self.dtype.itemsize), ("ids.bin", ids, 8), ("ts.bin", ts, 8)):
+                with open(self._file(name), "r+b") as f:
+                    f.seek(self.rows * row_size)
+                    f.write(data.tobytes())
+                    f.truncate()
+                    f.flush()
+                    os.fsync(f.fileno())
+            start, before = self.rows, len(self._row_of)
+            self._ids = np.concatenate([self._ids, ids])
+            self._ts = np.concatenate([self._ts, ts])
+            self._stale = np.concatenate([self._stale, np.zeros(len(ids), dtype=bool)])
+            for offset, message_id in enumerate(ids.tolist()):
+                self._mark(message_id, start + offset)
+            self.rows += len(ids)
+            self._write_meta()
+        self._notify(len(self._row_of) - before)
+
+    def upsert_list(self, message_ids: List[int], embeddings: List[List[float]], flush: bool = True,
+                    timestamps: Optional[List[int]] = None) -> None:
+        # 追加写入后旧行自动失效，与add_list相同
+        self.add_list(message_ids, embeddings, flush, timestamps)
+
+    def flush(self) -> None:
+        # 每次追加都已fsync
+        pass
+
+    def release(self) -> bool:
+        # 只丢弃内存映射，下次检索时重新映射
+        with self._lock:
+            self._vectors = None
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors = None
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._init_collection()
+
+    def similar_search(self, embedding: List[float], limits: int) -> Optional[list]:
+        return [message_id for message_id, _ in self.similar_search_scored(embedding, limits)]
+
+    def similar_search_scored(self, embedding: List[float], limits: int) -> List[Tuple[int, float]]:
+        return self.similar_search_many([embedding], limits)[0]
+
+    def similar_search_many(self, embeddings: List[List[float]], limits: int) -> List[List[Tuple[int, float]]]:
+        if not embeddings:
+            return []
+        queries = self._normalize(embeddings)
+        nq = len(queries)
+        with self._lock:
+            vectors = self._vector_view()
+            stale = self._stale.copy()
+            ids = self._ids
+        if len(vectors) == 0 or limits <= 0:
+            return [[] for _ in range(nq)]
+
+        # 分块计算余弦相似度，每块只保留各查询的前limits个候选
+        best_scores = np.full((nq, 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((nq, 0), dtype=np.int64)
+        for start in range(0, len(vectors), SEARCH_BLOCK_SIZE):
+            block = np.asarray(vectors[start:start + SEARCH_BLOCK_SIZE], dtype=np.float32)
+            scores = queries @ block.T
+            scores[:, stale[start:start + len(block)]] = -np.inf
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            if scores.shape[1] > limits:
+                keep = np.argpartition(-scores, limits - 1, axis=1)[:, :limits]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores, best_rows = scores, rows
+
+        results = []
+        for q in range(nq):
+            order = np.argsort(-best_scores[q])
+            results.append([
+                (int(ids[best_rows[q, i]]), float(best_scores[q, i]))
+                for i in order if np.isfinite(best_scores[q, i])
+            ])
+        return results
+
+    def exists(self, message_id: int) -> bool:
+        return int(message_id) in self._row_of
+
+    def exists_many(self, message_ids: List[int]) -> Set[int]:
+        with self._lock:
+            return {int(message_id) for message_id in message_ids if int(message_id) in self._row_of}
+
+    def iter_batches(self, batch_size: int = 4096) -> Iterator[Tuple[List[int], List[List[float]], Optional[List[int]]]]:
+        with self._lock:
+            vectors = self._vector_view()
+            stale = self._stale.copy()
+            ids, ts = self._ids, self._ts
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            live = ~stale[start:end]
+            if live.any():
+                yield (ids[start:end][live].tolist(),
+                       np.asarray(vectors[start:end][live], dtype=np.float32).tolist(),
+                       ts[start:end][live].tolist())
+
+    def iter_timestamps(self, batch_size: int = 16384) -> Iterator[Tuple[List[int], List[int]]]:
+        with self._lock:
+            live = ~self._stale
+            ids, ts = self._ids[live], self._ts[live]
+        for start in range(0, len(ids), batch_size):
+            yield ids[start:start + batch_size].tolist(), ts[start:start + batch_size].tolist()
+
+    @property
+    def supports_retention(self) -> bool:
+        return True
+
+    def delete(self, message_ids: List[int]) -> None:
+        with self._lock:
+            rows = [self._row_of.pop(int(message_id)) for message_id in message_ids if int(message_id) in self._row_of]
+            if not rows:
+                return
+            with open(self._file("deleted.bin"), "ab") as f:
+                f.write(np.asarray(rows, dtype=np.int64).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._stale[rows] = True
+            self._deleted_count += len(rows)
+        self._notify(-len(rows))
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * self.dtype.itemsize + 16
+
+    def size_bytes(self) -> int:
+        return sum(
+            os.path.getsize(self._file(name))
+            for name in ("vectors.bin", "ids.bin", "ts.bin", "deleted.bin")
+            if os.path.isfile(self._file(name))
+        )
+
+    def compact(self) -> None:
+        """把有效行重写到新目录后整体替换，去掉已删除和被覆盖的行"""
+        with self._lock:
+            if not self._stale.any():
+                return
+            live = ~self._stale
+            vectors = self._vector_view()
+            compact_path = self.path + ".compact"
+            shutil.rmtree(compact_path, ignore_errors=True)
+            os.makedirs(compact_path)
+            for name, data in (("vectors.bin", vectors[live]), ("ids.bin", self._ids[live]), ("ts.bin", self._ts[live])):
+                with open(os.path.join(compact_path, name), "wb") as f:
+                    f.write(np.ascontiguousarray(data).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._write_meta(compact_path, int(live.sum()))
+
+            self._vectors = None
+            os.replace(self.path, self.path + ".old")
+            os.replace(compact_path, self.path)
+            shutil.rmtree(self.path + ".old", ignore_errors=True)
+            self._init_collection()
+            logger.info(f"[compact]{self.collection_name}压缩完成，剩余{self.rows}行")
+
+    def rebuild_index(self) -> None:
+        # 暴力搜索没有索引
+        pass
+
+    def count(self) -> int:
+        return len(self._row_of)
@@ -0,0 +1,83 @@
+"""
+sharding.py
+"""
+import os
+import bisect
+import hashlib
+import itertools
+import threading
+from typing import List, Dict, Optional
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class ConsistentHashRing:
+    """一致性哈希环，新增节点时只有约1/N的key需要迁移"""
+
+    def __init__(self, nodes: Optional[List[str]] = None, replicas: int = 64):
+        self.replicas = replicas
+        self._keys: List[int] = []
+        self._nodes: Dict[int, str] = {}
+        for node in nodes or []:
+            self.add_node(node)
+
+    def add_node(self, node: str) -> None:
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            if point in self._nodes:
+                continue
+            bisect.insort(self._keys, point)
+            self._nodes[point] = node
+
+    def remove_node(self, node: str) -> None:
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                self._keys.remove(point)
+
+    def get_node(self, key: str) -> str:
+        if not self._keys:
+            raise ValueError("哈希环中没有节点")
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[self._keys[index]]
+
+
+class Shard:
+    """一台Milvus服务器（或一个Milvus Lite文件）及其连接池"""
+
+    def __init__(self, name: str, params: Optional[dict], aliases: List[str]):
+        self.name = name
+        self.params = params    # connections.connect的参数，None表示沿用DatabaseManager的单机连接
+        self.aliases = aliases
+        self._cycle = itertools.cycle(aliases)
+        self._lock = threading.Lock()
+
+    @property
+    def alias(self) -> str:
+        """用于list/drop等管理操作的连接"""
+        return self.aliases[0]
+
+    def next_alias(self) -> str:
+        """轮流分配连接池中的连接"""
+        with self._lock:
+            return next(self._cycle)
+
+
+def parse_server(entry: str, user: str = "", password: str = "") -> dict:
+    """
+    解析servers配置中的一项
+    支持 host:port、http(s)://host:port 以及以.db结尾的Milvus Lite文件路径（用于本地测试）
+    """
+    entry = entry.strip()
+    if entry.endswith(".db"):
+        os.makedirs(os.path.dirname(entry) or ".", exist_ok=True)
+        return {"uri": entry}
+    if "://" in entry:
+        return {"uri": entry, "user": user, "password": password}
+    host, sep, port = entry.rpartition(":")
+    if not sep:
+        host, port = entry, "19530"
+    return {"host": host, "port": port, "user": user, "password": password}
@@ -0,0 +1,183 @@
+"""
+snapshot.py
+"""
+import os
+import json
+import time
+import shutil
+from typing import List, Optional
+
+import numpy as np
+from astrbot.api import logger
+
+from .database import Database
+from .lexical import LexicalIndex
+
+SNAPSHOT_VERSION = 1
+CHUNK_SIZE = 65536      # 每个.npy分块保存的向量条数
+READ_BATCH_SIZE = 4096  # query_iterator 每次读取的条数
+LOAD_BATCH_SIZE = 8192  # 恢复时每次批量写入的条数
+MANIFEST_NAME = "manifest.json"
+LEXICAL_NAME = "lexical.sqlite3"
+
+
+def list_snapshots(snapshot_root: str, db_id: str) -> List[str]:
+    """返回某个集合所有完整的快照名（按时间从旧到新）"""
+    collection_dir = os.path.join(snapshot_root, db_id)
+    if not os.path.isdir(collection_dir):
+        return []
+    names = [
+        name for name in os.listdir(collection_dir)
+        if os.path.isfile(os.path.join(collection_dir, name, MANIFEST_NAME))
+    ]
+    return sorted(names)
+
+
+def read_manifest(snapshot_dir: str) -> dict:
+    with open(os.path.join(snapshot_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _prune_snapshots(snapshot_root: str, db_id: str, keep: int) -> None:
+    """只保留最近keep个快照"""
+    if keep <= 0:
+        return
+    for name in list_snapshots(snapshot_root, db_id)[:-keep]:
+        shutil.rmtree(os.path.join(snapshot_root, db_id, name), ignore_errors=True)
+        logger.info(f"[snapshot]删除过期快照 {db_id}/{name}")
+
+
+def export_snapshot(collection: Database, db_id: str, snapshot_root: str,
+                    model_name: Optional[str] = None, keep: int = 3,
+                    lexical: Optional[LexicalIndex] = None) -> Optional[str]:
+    """
+    将集合的(message_id, embedding)流式导出为分块的.npy文件
+    :param lexical: 集合对应的关键词索引，一并备份到快照中
+    :return: 快照目录，集合为空时返回None
+    """
+    now = time.time()
+    # 精确到毫秒，同一毫秒内重复导出时再加序号，避免与已有快照重名
+    base_name = time.strftime("%Y%m%d_%H%M%S", time.localtime(now)) + f"_{int(now * 1000) % 1000:03d}"
+    name, suffix = base_name, 0
+    while os.path.exists(os.path.join(snapshot_root, db_id, name)):
+        suffix += 1
+        name = f"{base_name}_{suffix}"
+    final_dir = os.path.join(snapshot_root, db_id, name)
+    # 先写入临时目录，写完manifest后再改名，中途失败不会留下半个快照
+    tmp_dir = final_dir + ".partial"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    chunks = []
+    ids_buf = None
+    emb_buf = None
+    ts_buf = None
+    filled = 0
+    dim = None
+    total = 0
+
+    def _write_chunk():
+        index = len(chunks)
+        ids_file = f"ids_{index:05d}.npy"
+        emb_file = f"emb_{index:05d}.npy"
+        np.save(os.path.join(tmp_dir, ids_file), ids_buf[:filled])
+        np.save(os.path.join(tmp_dir, emb_file), emb_buf[:filled])
+        chunk = {"ids": ids_file, "embeddings": emb_file, "count": filled}
+        if ts_buf is not None:
+            chunk["timestamps"] = f"ts_{index:05d}.npy"
+            np.save(os.path.join(tmp_dir, chunk["timestamps"]), ts_buf[:filled])
+        chunks.append(chunk)
+
+    try:
+        for message_ids, embeddings, timestamps in collection.iter_batches(READ_BATCH_SIZE):
+            batch_ids = np.asarray(message_ids, dtype=np.int64)
+            batch_emb = np.asarray(embeddings, dtype=np.float32)
+            batch_ts = None if timestamps is None else np.asarray(timestamps, dtype=np.int64)
+            if dim is None:
+                dim = batch_emb.shape[1]
+                ids_buf = np.empty(CHUNK_SIZE, dtype=np.int64)
+                emb_buf = np.empty((CHUNK_SIZE, dim), dtype=np.float32)
+                if batch_ts is not None:
+                    ts_buf = np.empty(CHUNK_SIZE, dtype=np.int64)
+
+            offset = 0
+            while offset < len(batch_ids):
+                n = min(CHUNK_SIZE - filled, len(batch_ids) - offset)
+                ids_buf[filled:filled + n] = batch_ids[offset:offset + n]
+                emb_buf[filled:filled + n] = batch_emb[offset:offset + n]
+                if ts_buf is not None:
+                    ts_buf[filled:filled + n] = batch_ts[offset:offset + n]
+                filled += n
+                offset += n
+                if filled == CHUNK_SIZE:
+                    _write_chunk()
+                    filled = 0
+            total += len(batch_ids)
+
+        if total == 0:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            logger.info(f"[snapshot]{db_id}为空，跳过快照")
+            return None
+        if filled:
+            _write_chunk()
+
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "collection_name": db_id,
+            "model": model_name,
+            "dim": dim,
+            "count": total,
+            "created_at": int(time.time()),
+            "chunks": chunks,
+        }
+        # 向量中没有消息原文，关键词索引需要单独备份
+        if lexical is not None:
+            lexical.backup_to(os.path.join(tmp_dir, LEXICAL_NAME))
+            manifest["lexical"] = LEXICAL_NAME
+        with open(os.path.join(tmp_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_dir, final_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    logger.info(f"[snapshot]已导出{db_id}共{total}条记录到{final_dir}")
+    _prune_snapshots(snapshot_root, db_id, keep)
+    return final_dir
+
+
+def load_snapshot(collection: Database, snapshot_dir: str, dim: int,
+                  model_name: Optional[str] = None, lexical: Optional[LexicalIndex] = None) -> int:
+    """
+    将快照批量写回集合
+    :param lexical: 快照中带有关键词索引时合并到该索引
+    :return: 恢复的记录条数
+    """
+    manifest = read_manifest(snapshot_dir)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"不支持的快照版本: {manifest.get('version')}")
+    if manifest["dim"] != dim:
+        raise ValueError(f"快照维度{manifest['dim']}与当前维度{dim}不一致")
+    if model_name and manifest.get("model") and manifest["model"] != model_name:
+        raise ValueError(f"快照模型{manifest['model']}与当前模型{model_name}不一致")
+
+    # 空集合直接insert，否则用upsert避免产生重复主键
+    write = collection.add_list if collection.count() == 0 else collection.upsert_list
+    restored = 0
+    for chunk in manifest["chunks"]:
+        ids = np.load(os.path.join(snapshot_dir, chunk["ids"]), mmap_mode="r")
+        embeddings = np.load(os.path.join(snapshot_dir, chunk["embeddings"]), mmap_mode="r")
+        timestamps = None
+        if "timestamps" in chunk:
+            timestamps = np.load(os.path.join(snapshot_dir, chunk["timestamps"]), mmap_mode="r")
+        for start in range(0, len(ids), LOAD_BATCH_SIZE):
+            end = min(start + LOAD_BATCH_SIZE, len(ids))
+            write(ids[start:end].tolist(), embeddings[start:end].tolist(), flush=False,
+                  timestamps=None if timestamps is None else timestamps[start:end].tolist())
+            restored += end - start
+    collection.flush()
+    if lexical is not None and manifest.get("lexical"):
+        merged = lexical.merge_from(os.path.join(snapshot_dir, manifest["lexical"]))
+        logger.info(f"[snapshot]已从{snapshot_dir}恢复{merged}条关键词索引")
+    logger.info(f"[snapshot]已从{snapshot_dir}恢复{restored}条记录")
+    return restored